@@ -0,0 +1,42 @@
+'''
+Compares looking up the summary fields of a trial with one soup.find per field (how Trial used to do it) against one CTIS.index_ids pass.
+
+    python benchmarks/bench_extraction.py [summary.html ...]
+
+Without arguments, the summary page from test_fixtures is used.
+'''
+import os
+import sys
+import timeit
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclinicaltrials import CTIS
+
+FIXTURE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_fixtures', '2022-500024-30-00', 'summary.html'))
+PREFIX = '_emactview_WAR_emactpublicportlet_:mainFormID:'
+IDS = [PREFIX + id for id in ['trialInfoSponsorId', 'trialInfoConditionsId', 'trialInfoVulnerablePopulationsId', 'trialInfoTherapeuticAreaId', 'trialInfoTrialPhaseId', 'trialInfoLowInterStudyLabelNoId', 'isTransitionedLabelNoId', 'trialInfoMedicalDeviceLabelNoId', 'trialInfoFirstSumbittedId', 'trialInfoLastUpdatedId']] + ['_emactview_WAR_emactpublicportlet_:ctPublicViewHeaderFornId:trialDescriptionId', 'trialStatusInfoDataTableId']
+
+
+def find_each(soup: BeautifulSoup) -> list:
+    return [soup.find(id=id) for id in IDS]
+
+
+def index_once(soup: BeautifulSoup) -> list:
+    index = CTIS.index_ids(soup)
+    return [index.get(id) for id in IDS]
+
+
+def main(paths: list) -> None:
+    for path in paths:
+        with open(path, 'rb') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        assert find_each(soup) == index_once(soup)
+        print(path)
+        for function in [find_each, index_once]:
+            number, total = timeit.Timer(lambda: function(soup)).autorange()
+            print('  %-10s %8.1f µs per trial' % (function.__name__, total / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or [FIXTURE])
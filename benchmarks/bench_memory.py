@@ -0,0 +1,55 @@
+'''
+Measures the peak resident memory of holding many trials: as Trial objects with their parsed pages, and as TrialRecords.
+
+    python benchmarks/bench_memory.py [number of trials]
+
+The fixture trial from test_fixtures is replayed for every number, so no network is needed. Each mode runs in a fresh process, since the peak RSS of a process never goes down.
+'''
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclinicaltrials import Trial, replay_session
+from fixture_recording import record_fixtures
+
+
+def run(mode: str, count: int) -> None:
+    numbers = ['2022-5%05d-00-00' % i for i in range(count)]
+    with tempfile.TemporaryDirectory() as directory:
+        record_fixtures(directory, numbers)
+        session = replay_session(directory)
+        run_trials(mode, numbers, session)
+
+
+def run_trials(mode: str, numbers: list, session: requests.Session) -> None:
+    kept = []
+    start = time.perf_counter()
+    for number in numbers:
+        trial = Trial(number, session=session)
+        if mode == 'trials':
+            # Touch both tabs, like to_record does
+            trial.sponsor()
+            trial.scope()
+            kept.append(trial)
+        else:
+            kept.append(trial.to_record())
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    print('  %-8s %6d trials %8.1f s %8d MB peak RSS' % (mode, len(numbers), elapsed, peak // 1024))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        run(sys.argv[1], int(sys.argv[2]))
+    else:
+        count = sys.argv[1] if len(sys.argv) == 2 else '1000'
+        for mode in ['trials', 'records']:
+            subprocess.run([sys.executable, __file__, mode, count], check=True)
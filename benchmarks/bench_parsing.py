@@ -0,0 +1,49 @@
+'''
+Compares parse time and peak memory of the parser backends on trial pages.
+
+    python benchmarks/bench_parsing.py [page.html ...]
+
+Without arguments, the pages in test_fixtures are used. Peak memory is measured with tracemalloc, so it covers the Python objects of the soup but not lxml's own buffers.
+'''
+import glob
+import os
+import sys
+import timeit
+import tracemalloc
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclinicaltrials import CTIS
+
+FIXTURES = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_fixtures'))
+BACKENDS = [
+    ('html.parser', None),
+    ('lxml', None),
+    ('html.parser', CTIS.FORMS_ONLY),
+    ('lxml', CTIS.FORMS_ONLY),
+]
+
+
+def peak_memory(function) -> int:
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main(paths: list) -> None:
+    for path in paths:
+        with open(path, 'rb') as f:
+            page = f.read()
+        print('%s (%d kB)' % (path, len(page) // 1024))
+        for parser, parse_only in BACKENDS:
+            parse = lambda: BeautifulSoup(page, parser, parse_only=parse_only)
+            number, total = timeit.Timer(parse).autorange()
+            name = parser + (' + forms only' if parse_only is not None else '')
+            print('  %-25s %8.2f ms %8d kB peak' % (name, total / number * 1e3, peak_memory(parse) // 1024))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob(os.path.join(FIXTURES, '*', '*.html'))))
@@ -0,0 +1,103 @@
+'''
+Benchmarks parsing and extracting trials from recorded portal responses, so no network is involved.
+
+Record some trials from the portal once:
+
+    python benchmarks/bench_trials.py record recordings 2022-500024-30-00 2022-500137-89-00 ...
+
+Then benchmark them as often as needed:
+
+    python benchmarks/bench_trials.py run [recordings] [--trials N]
+
+Without a recordings directory, the fixture trial from test_fixtures is used. The report has the latency of each step per trial, the throughput of Trial.to_record over N trials and the memory allocated per trial.
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclinicaltrials import Trial, recordings, replay_session
+from fixture_recording import record_fixtures
+
+# The steps of loading a trial, in the order they happen. The first two include reading the recording and parsing the page.
+STEPS = [
+    ('summary tab', lambda trial: trial.sponsor()),
+    ('full information tab', lambda trial: trial.scope()),
+    ('overall_trial_status_table', lambda trial: trial.overall_trial_status_table()),
+    ('documents_part_1', lambda trial: trial.documents_part_1()),
+    ('documents_part_2', lambda trial: trial.documents_part_2()),
+    ('planned_subjects_by_country', lambda trial: trial.planned_subjects_by_country()),
+    ('scalar fields', lambda trial: [getattr(trial, field)() for field in Trial.FIELDS]),
+]
+
+
+def recorded_trials(directory: str) -> list:
+    numbers = set()
+    for method, url in recordings(directory):
+        query = parse_qs(urlparse(url).query)
+        if '_emactview_WAR_emactpublicportlet_number' in query:
+            numbers.add(query['_emactview_WAR_emactpublicportlet_number'][0])
+    return sorted(numbers)
+
+
+def record(directory: str, numbers: list) -> None:
+    session = replay_session(directory, mode='record')
+    for number in numbers:
+        Trial(number, session=session).to_record()
+        print('recorded', number)
+
+
+def run(directory: str, trial_count: int) -> None:
+    session = replay_session(directory)
+    numbers = recorded_trials(directory)
+    print('%d recorded trials in %s' % (len(numbers), directory))
+
+    timings = {name: [] for name, step in STEPS}
+    for number in numbers:
+        trial = Trial(number, session=session)
+        for name, step in STEPS:
+            start = time.perf_counter()
+            step(trial)
+            timings[name].append(time.perf_counter() - start)
+    print('Latency per trial (median / max):')
+    for name, times in timings.items():
+        print('  %-30s %8.2f ms %8.2f ms' % (name, statistics.median(times) * 1e3, max(times) * 1e3))
+
+    start = time.perf_counter()
+    for i in range(trial_count):
+        Trial(numbers[i % len(numbers)], session=session).to_record()
+    elapsed = time.perf_counter() - start
+    print('Throughput: %d trials in %.2f s, %.1f trials/s' % (trial_count, elapsed, trial_count / elapsed))
+
+    peaks = []
+    for number in numbers:
+        tracemalloc.start()
+        Trial(number, session=session).to_record()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    print('Allocations per trial: %.0f kB peak (median), %.0f kB peak (max)' % (statistics.median(peaks) / 1024, max(peaks) / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record')
+    record_parser.add_argument('directory')
+    record_parser.add_argument('numbers', nargs='+')
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('directory', nargs='?')
+    run_parser.add_argument('--trials', type=int, default=100)
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.directory, args.numbers)
+    elif args.directory is not None:
+        run(args.directory, args.trials)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            record_fixtures(directory)
+            run(directory, args.trials)
@@ -0,0 +1,23 @@
+'''
+Turns the pages in test_fixtures into a recording that RecordReplayAdapter can replay, for benchmarks that should run without a recording of the real portal.
+'''
+import os
+import sys
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclinicaltrials import CTIS, Trial, save_recording
+
+FIXTURES = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_fixtures'))
+FIXTURE_TRIAL = '2022-500024-30-00'
+
+
+def record_fixtures(directory: str, numbers: List[str] = [FIXTURE_TRIAL]) -> None:
+    '''
+    Records the fixture trial's pages for every trial number in numbers.
+    '''
+    for tab in Trial.TABS:
+        with open(os.path.join(FIXTURES, FIXTURE_TRIAL, tab + '.html'), 'rb') as f:
+            content = f.read()
+        for number in numbers:
+            save_recording(directory, 'GET', CTIS.trial_tab_url(number, tab), content, headers={'Content-Type': 'text/html;charset=UTF-8'})
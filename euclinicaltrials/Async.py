@@ -0,0 +1,132 @@
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from typing import AsyncIterator, Dict, List, Set
+from bs4 import SoupStrainer
+import requests
+from . import CTIS
+from .Trial import Trial
+from .TrialRecord import TrialRecord
+
+
+def extract_record(EUCTNUMBER: str, pages: Dict[str, bytes], parser: str = None, parse_only: SoupStrainer = None) -> TrialRecord:
+    '''
+    Parses the pages of a trial into a TrialRecord. This is what AsyncTrial runs in the process pool.
+
+    Pass the CTIS.PARSER and CTIS.PARSE_ONLY of the calling process as parser and parse_only: a process pool may start fresh processes (the default on macOS and Windows), which would otherwise parse with the defaults. Without a parser, the settings of the process it runs in are used.
+    '''
+    return Trial.from_pages(EUCTNUMBER, pages, parser=parser, parse_only=parse_only).to_record()
+
+
+class AsyncCTIS:
+    '''
+    Async access to the portal for asyncio programs.
+
+    All requests go through one session, and so one connection pool, with at most concurrency requests at a time. That includes the pages of a running trial_numbers sweep. They run in a thread pool, so the event loop never waits for the network. Parsing runs in parse_executor, by default a process pool, so BeautifulSoup doesn't hold up the event loop either.
+
+    Use it with "async with", or call close() when done.
+    '''
+
+    def __init__(self, concurrency: int = 8, session: requests.Session = None, parse_executor: Executor = None) -> None:
+        self.concurrency = concurrency
+        self.session = session if session is not None else CTIS.new_session(concurrency)
+        # Created on first use, since on older Pythons it binds to the event loop that is current when it is created
+        self.__semaphore = None
+        # Held by every request while it runs. The semaphore above only keeps get() from piling up threads, but the sweep's requests come from its own threads.
+        self.__limit = threading.BoundedSemaphore(concurrency)
+        # The trial number sweep runs its own pool, but waits for it in one of these threads
+        self.__threads = ThreadPoolExecutor(max_workers=concurrency + 1)
+        self.__parse_executor = parse_executor if parse_executor is not None else ProcessPoolExecutor()
+
+    async def __aenter__(self) -> AsyncCTIS:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.__threads.shutdown(wait=False)
+        self.__parse_executor.shutdown(wait=False)
+        self.session.close()
+
+    async def get(self, url: str, **kwargs) -> requests.Response:
+        '''
+        Makes a GET request through the shared session. The response is read completely before this returns.
+        '''
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.__semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.__threads, partial(self.__get, url, **kwargs))
+
+    def __get(self, url: str, **kwargs) -> requests.Response:
+        with self.__limit:
+            return self.session.get(url, **kwargs)
+
+    async def parse(self, function, *args):
+        '''
+        Runs function(*args) in the parse executor. With the default process pool, function and its arguments must be picklable.
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.__parse_executor, partial(function, *args))
+
+    async def trial_numbers(self, page_size: int = 20, known: Set[str] = None, since: date = None) -> AsyncIterator[str]:
+        '''
+        Yields the ids of all trials like CTIS.iter_trial_numbers, with up to concurrency pages fetched at a time. The pages count against the same limit as all other requests of this client.
+        '''
+        numbers = CTIS.iter_trial_numbers(workers=self.concurrency, session=self.session, page_size=page_size, known=known, since=since, limit=self.__limit)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                number = await loop.run_in_executor(self.__threads, next, numbers, None)
+                if number is None:
+                    return
+                yield number
+        finally:
+            await loop.run_in_executor(self.__threads, numbers.close)
+
+    def trial(self, EUCTNUMBER: str) -> AsyncTrial:
+        return AsyncTrial(EUCTNUMBER, self)
+
+    async def records(self, EUCTNUMBERS: List[str]) -> List[TrialRecord]:
+        '''
+        Loads many trials concurrently and returns their records in the same order.
+        '''
+        return await asyncio.gather(*(self.trial(EUCTNUMBER).record() for EUCTNUMBER in EUCTNUMBERS))
+
+
+class AsyncTrial:
+    '''
+    The async counterpart of Trial. Its pages are loaded with await load(), and await record() parses them into a TrialRecord off the event loop.
+    '''
+
+    def __init__(self, EUCTNUMBER: str, client: AsyncCTIS) -> None:
+        self.EUCTNUMBER = EUCTNUMBER
+        self.client = client
+        self.pages = {}
+
+    async def load(self, tabs: List[str] = ['summary', 'fullInformation']) -> Dict[str, bytes]:
+        '''
+        Loads the given tabs concurrently, unless they are loaded already, and returns all loaded pages by tab.
+        '''
+        missing = [tab for tab in tabs if tab not in self.pages]
+        responses = await asyncio.gather(*(self.client.get(CTIS.trial_tab_url(self.EUCTNUMBER, tab)) for tab in missing))
+        for response in responses:
+            response.raise_for_status()
+        for tab, response in zip(missing, responses):
+            self.pages[tab] = response.content
+        return self.pages
+
+    async def record(self) -> TrialRecord:
+        '''
+        Loads the summary and full information tabs and extracts everything into a TrialRecord in the parse executor.
+        '''
+        await self.load()
+        return await self.client.parse(extract_record, self.EUCTNUMBER, self.pages, CTIS.PARSER, CTIS.PARSE_ONLY)
+
+    def trial(self) -> Trial:
+        '''
+        Returns a Trial with the pages loaded so far. Its accessors parse in the calling thread.
+        '''
+        return Trial.from_pages(self.EUCTNUMBER, self.pages, session=self.client.session)
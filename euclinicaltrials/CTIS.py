@@ -1,35 +1,105 @@
 from __future__ import annotations
 import requests
 from pytz import timezone
-from bs4 import BeautifulSoup, element
+from bs4 import BeautifulSoup, SoupStrainer, element
 import re
-from datetime import datetime
+import codecs
+import itertools
+import html
+import threading
+from contextlib import nullcontext
+from collections import deque
+from datetime import datetime, date
 from .Document import Document
-from typing import List, Dict
+from . import Instrumentation, Transport
+import pandas as pd
+from typing import List, Dict, Set, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_URI = "https://euclinicaltrials.eu"
 
-def __get_all_trials_search_content(view_state:str, jsessionid:str, page:int = 1):
+TRIAL_NUMBER_PATTERN = re.compile(r'2\d\d\d-\d\d\d\d\d\d-\d\d-\d\d')
+TRIAL_NUMBER_LENGTH = 17
+DATE_PATTERN = re.compile(r'\d\d/\d\d/\d\d\d\d')
+DATE_LENGTH = 10
+RESULTS_COUNT_PATTERN = re.compile(r'>(\d*) results found</span>')
+VIEW_STATE_INPUT_PATTERN = re.compile(r'<input[^>]*id="_emactsearch_WAR_emactpublicportlet_:javax\.faces\.ViewState:0"[^>]*>')
+VALUE_PATTERN = re.compile(r'value="([^"]*)"')
+
+# Search result pages are read in chunks of this many bytes
+CHUNK_SIZE = 16*1024
+SCAN_OVERLAP = max(TRIAL_NUMBER_LENGTH, DATE_LENGTH)
+# What parse_table counts as a number, as pd.read_html with its default thousands separator does
+NUMBER_PATTERN = re.compile(r'[-+]?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?')
+
+# The parser BeautifulSoup uses for all pages. "lxml" parses the fixture pages about 20% faster than Python's built-in "html.parser" (see benchmarks/bench_parsing.py), but it has only been checked against the pages in test_fixtures so far, not against pages recorded from the portal. Parsers can repair broken markup differently, and Trial walks the tree with next_sibling, so it stays opt-in until then.
+PARSER = "html.parser"
+
+# On the pages in test_fixtures, everything Trial reads from a trial page is inside its forms. Setting PARSE_ONLY = FORMS_ONLY skips building the rest of the page (navigation, footer, scripts). On the small fixture pages that saves little time, mostly memory. Like lxml, it hasn't been checked against recorded portal pages yet.
+FORMS_ONLY = SoupStrainer("form")
+PARSE_ONLY = None
+
+def make_soup(markup: bytes, parse_only: SoupStrainer = None, parser: str = None) -> BeautifulSoup:
+    '''
+    Parses a page with parser, or the configured PARSER if none is given.
+    '''
+    with Instrumentation.measure('parse', 'soup', bytes=len(markup)):
+        return BeautifulSoup(markup, parser if parser is not None else PARSER, parse_only=parse_only)
+
+def trial_tab_url(EUCTNUMBER: str, tab: str) -> str:
+    '''
+    This is the URL of one of the tabs in Trial.TABS of a trial.
+    '''
+    return BASE_URI + '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2F' + tab + '.xhtml'
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    '''
+    Creates a session that keeps up to pool_size connections to the portal alive, so consecutive requests don't each need a new TCP/TLS handshake. Its requests are rate limited, retried and paused during outages as described in Transport.PortalSession.
+    '''
+    session = Transport.PortalSession()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+__default_session = None
+__default_session_lock = threading.Lock()
+
+def default_session() -> requests.Session:
+    '''
+    Returns the session used when no other one is given, which is shared by everything in this package.
+    '''
+    global __default_session
+    with __default_session_lock:
+        if __default_session is None:
+            __default_session = new_session()
+        return __default_session
+
+def __get_all_trials_search_content(view_state:str, jsessionid:str, page:int = 1, session: requests.Session = requests, page_size: int = 20) -> requests.Response:
     # This code was generated with [harreplay](https://github.com/gtzampanakis/harreplay), worked really neatly! The request is changed with the page number, the ViewState, and the JSESSIONID from the first page.
-    response = requests.post(
+    response = session.post(
         BASE_URI + '/search-for-clinical-trials?p_p_id=emactsearch_WAR_emactpublicportlet&p_p_lifecycle=2&p_p_state=normal&p_p_mode=view&p_p_cacheability=cacheLevelPage&p_p_col_id=column-1&p_p_col_count=1&_emactsearch_WAR_emactpublicportlet__jsfBridgeAjax=true&_emactsearch_WAR_emactpublicportlet__facesViewIdResource=%2FWEB-INF%2Fviews%2Fsearch%2Ftabs%2FsearchResults.xhtml',
 
         headers={'Host': 'euclinicaltrials.eu', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:102.0) Gecko/20100101 Firefox/102.0', 'Accept': '*/*', 'Accept-Language': 'en,de;q=0.7,en-US;q=0.3', 'Accept-Encoding': 'gzip, deflate, br', 'Referer': 'https://euclinicaltrials.eu/search-for-clinical-trials?p_p_id=emactsearch_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&_emactsearch_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fsearch%2Ftabs%2FsearchResults.xhtml', 'Faces-Request': 'partial/ajax', 'Content-type': 'application/x-www-form-urlencoded;charset=UTF-8', 'Origin': 'https://euclinicaltrials.eu', 'Connection': 'keep-alive', 'Cookie': 'COOKIE_SUPPORT=true; GUEST_LANGUAGE_ID=en_GB; accepted_cookie=true; JSESSIONID=' + jsessionid, 'Sec-Fetch-Dest': 'empty', 'Sec-Fetch-Mode': 'cors', 'Sec-Fetch-Site': 'same-origin', 'Pragma': 'no-cache', 'Cache-Control': 'no-cache'},
 
-        data='_emactsearch_WAR_emactpublicportlet_%3AmainFormID=_emactsearch_WAR_emactpublicportlet_%3AmainFormID&javax.faces.encodedURL=https%3A%2F%2Feuclinicaltrials.eu%2Fsearch-for-clinical-trials%3Fp_p_id%3Demactsearch_WAR_emactpublicportlet%26p_p_lifecycle%3D2%26p_p_state%3Dnormal%26p_p_mode%3Dview%26p_p_cacheability%3DcacheLevelPage%26p_p_col_id%3Dcolumn-1%26p_p_col_count%3D1%26_emactsearch_WAR_emactpublicportlet__jsfBridgeAjax%3Dtrue%26_emactsearch_WAR_emactpublicportlet__facesViewIdResource%3D%252FWEB-INF%252Fviews%252Fsearch%252Ftabs%252FsearchResults.xhtml&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3Aj_idt34=decisionDate&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3Aj_idt37=DESC&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsDataTableId_selectedRowIndexes=&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AsearchResultRowsPerPageId=20&javax.faces.ViewState=' + view_state + '&javax.faces.source=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId&javax.faces.partial.event=click&javax.faces.partial.execute=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId%20_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId&javax.faces.partial.render=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId%20_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsDataTableId&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId_paginatorAction=' + str(page) + '&javax.faces.behavior.event=action&javax.faces.partial.ajax=true',
+        data='_emactsearch_WAR_emactpublicportlet_%3AmainFormID=_emactsearch_WAR_emactpublicportlet_%3AmainFormID&javax.faces.encodedURL=https%3A%2F%2Feuclinicaltrials.eu%2Fsearch-for-clinical-trials%3Fp_p_id%3Demactsearch_WAR_emactpublicportlet%26p_p_lifecycle%3D2%26p_p_state%3Dnormal%26p_p_mode%3Dview%26p_p_cacheability%3DcacheLevelPage%26p_p_col_id%3Dcolumn-1%26p_p_col_count%3D1%26_emactsearch_WAR_emactpublicportlet__jsfBridgeAjax%3Dtrue%26_emactsearch_WAR_emactpublicportlet__facesViewIdResource%3D%252FWEB-INF%252Fviews%252Fsearch%252Ftabs%252FsearchResults.xhtml&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3Aj_idt34=decisionDate&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3Aj_idt37=DESC&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsDataTableId_selectedRowIndexes=&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AsearchResultRowsPerPageId=' + str(page_size) + '&javax.faces.ViewState=' + view_state + '&javax.faces.source=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId&javax.faces.partial.event=click&javax.faces.partial.execute=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId%20_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId&javax.faces.partial.render=_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId%20_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsDataTableId&_emactsearch_WAR_emactpublicportlet_%3AmainFormID%3AtrialSearchResultsPaginatorId_paginatorAction=' + str(page) + '&javax.faces.behavior.event=action&javax.faces.partial.ajax=true',
+        stream=True,
     )
-    return response.content.decode('utf-8')
+    response.raise_for_status()
+    return response
 
 def is_unavailable() -> bool:
     '''
     Checks if the CTIS reports being current unavailable, for example for maintenance.
     '''
-    response = requests.get(BASE_URI + "/website-outages-and-system-releases")
+    # The shared session would wait for the circuit breaker, which stays open during exactly the outages this should report
+    with Transport.PortalSession(circuit_breaker=Transport.CircuitBreaker(pause_for_maintenance=False), retries=1) as session:
+        response = session.get(BASE_URI + "/website-outages-and-system-releases")
     assert response.status_code == 200
     response = response.text
     return "CTIS public portal is temporarily unavailable" in response
 
-def is_maintenace_window(time: datetime = datetime.now()) -> bool:
+def is_maintenace_window(time: datetime = None) -> bool:
     '''
     Checks whether time is during the regularly scheduled maintenance windows. if no argument time is given checks the current time.
 
@@ -38,48 +108,130 @@ def is_maintenace_window(time: datetime = datetime.now()) -> bool:
     Each Tuesday and Thursday: 18:00 to 21:00 Amsterdam time
     Each first Saturday of the month, from 10:00 to 14:00 Amsterdam time
     '''
+    if time is None:
+        time = datetime.now()
     amsterdam_timezone = timezone("Europe/Amsterdam")
     time = time.astimezone(amsterdam_timezone)
     if time.weekday() == 1 or time.weekday() == 3:
         # Tuesday or Thursday
         if 18 <= time.hour < 21:
             return True
-    elif time.weekday() == 6 and time.day <= 7:
+    elif time.weekday() == 5 and time.day <= 7:
         # Saturday
         if 10 <= time.hour < 14:
             return True
     return False
 
-def get_all_trial_numbers() -> List[str]:
+def get_all_trial_numbers(workers: int = 1, session: requests.Session = None, page_size: int = 20, known: Set[str] = None, since: date = None) -> List[str]:
     '''
-    This method returns the ids of all trials in the database.
+    This method returns the ids of all trials in the database, in the order the search lists them (newest decision date first). See iter_trial_numbers for the arguments.
     '''
+    return list(iter_trial_numbers(workers=workers, session=session, page_size=page_size, known=known, since=since))
+
+def iter_trial_numbers(workers: int = 1, session: requests.Session = None, page_size: int = 20, known: Set[str] = None, since: date = None, limit: threading.Semaphore = None) -> Iterator[str]:
+    '''
+    Yields the ids of all trials in the database, in the order the search lists them (newest decision date first). Each page of results is streamed and scanned for trial numbers as it arrives, so the first ids come in long before the sweep is done.
+
+    With workers > 1 the result pages are fetched concurrently. All requests share one session (and so one keep-alive connection pool), the ViewState and the JSESSIONID of the first page.
+
+    page_size is the number of trials requested per page. Bigger pages mean fewer requests.
+
+    For incremental updates, pass the numbers you already have as known and/or the date of the last run as since. Paging then stops at the first page with nothing new on it, i.e. where all numbers are known or all dates are before since. Only the numbers from the pages before that one are yielded.
+
+    If a limit is given, every request holds it until its page is read, so the sweep shares a cap on concurrent requests with other code (see AsyncCTIS).
+    '''
+    if session is None:
+        session = new_session(workers)
+    limit = limit if limit is not None else nullcontext()
     # Open the search page to get the number of trials and the ViewState and JSESSIONID we need to access them
     URL = BASE_URI + '/search-for-clinical-trials?p_p_id=emactsearch_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&_emactsearch_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fsearch%2Ftabs%2FsearchResults.xhtml'
-    response = requests.get(URL)
-    page1 = response.content.decode('utf-8')
-    results_count_matches = re.findall('>\d* results found</span>', page1)
+    with limit:
+        response = session.get(URL)
+        response.raise_for_status()
+        page1 = response.content.decode('utf-8')
+    results_count_matches = RESULTS_COUNT_PATTERN.findall(page1)
     assert len(results_count_matches) == 1
-    results_count = int(re.sub('\D', '', results_count_matches[0]))
-    soup_search = BeautifulSoup(page1, "html.parser")
-    view_state = soup_search.find(id='_emactsearch_WAR_emactpublicportlet_:javax.faces.ViewState:0').attrs['value']
+    results_count = int(results_count_matches[0])
+    view_state_input = VIEW_STATE_INPUT_PATTERN.search(page1).group(0)
+    view_state = html.unescape(VALUE_PATTERN.search(view_state_input).group(1))
     request_headers = response.headers['Set-Cookie'].split(';')
     for header in request_headers:
         if 'JSESSIONID' in header:
             jsessionid = header.split('=')[1]
             break
+    del page1
+
+    def fetch_page(i: int) -> Tuple[List[str], date]:
+        with limit:
+            return __read_search_page(__get_all_trials_search_content(view_state=view_state, jsessionid=jsessionid, page=i, session=session, page_size=page_size))
 
-    numbers = set()
-    for i in range(1,(results_count-1)//20+2):
-        page = __get_all_trials_search_content(view_state=view_state,jsessionid=jsessionid, page=i)
-        new_numbers = set(re.findall('2\d\d\d-\d\d\d\d\d\d-\d\d-\d\d',page))
-        numbers |= new_numbers
-    return list(numbers)
+    incremental = known is not None or since is not None
+    page_count = (results_count-1)//page_size+1
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only as many pages as there are workers are requested ahead of the one being read. That keeps the order, and incremental mode doesn't overshoot the first page with nothing new by much.
+        pending = deque()
+        next_page = 1
+        try:
+            for i in range(1, page_count+1):
+                while next_page <= page_count and len(pending) < workers:
+                    pending.append(executor.submit(fetch_page, next_page))
+                    next_page += 1
+                page_numbers, newest_date = pending.popleft().result()
+                assert i == page_count or len(set(page_numbers)) >= page_size, "The portal returned fewer trials than page_size, try a smaller one"
+                if incremental and not __has_new_trials(page_numbers, newest_date, known, since):
+                    return
+                for number in page_numbers:
+                    if number not in seen:
+                        seen.add(number)
+                        yield number
+        finally:
+            for future in pending:
+                future.cancel()
+
+def __read_search_page(response: requests.Response) -> Tuple[List[str], date]:
+    '''
+    Reads a page of search results in chunks and returns the trial numbers on it and its newest date, without ever holding the whole page.
+    '''
+    with Instrumentation.measure('parse', 'search page') as event:
+        numbers = []
+        newest_date = None
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ''
+        for chunk in itertools.chain(response.iter_content(chunk_size=CHUNK_SIZE), [None]):
+            final = chunk is None
+            event.bytes += len(chunk or b'')
+            buffer += decoder.decode(chunk or b'', final=final)
+            # Both patterns have a fixed length, so a match starting before the last SCAN_OVERLAP characters is complete. Those last characters are scanned again together with the next chunk.
+            cutoff = len(buffer) if final else max(len(buffer) - SCAN_OVERLAP, 0)
+            numbers += TRIAL_NUMBER_PATTERN.findall(buffer, 0, min(len(buffer), cutoff + TRIAL_NUMBER_LENGTH - 1))
+            for match in DATE_PATTERN.findall(buffer, 0, min(len(buffer), cutoff + DATE_LENGTH - 1)):
+                match_date = parse_CTIS_date(match)
+                if newest_date is None or match_date > newest_date:
+                    newest_date = match_date
+            buffer = buffer[cutoff:]
+        return numbers, newest_date
+
+def __has_new_trials(page_numbers: List[str], newest_date: date = None, known: Set[str] = None, since: date = None) -> bool:
+    if known is not None and all(number in known for number in page_numbers):
+        return False
+    if since is not None and newest_date is not None and newest_date < since:
+        return False
+    return True
 
 def get_content_by_id(soup: BeautifulSoup, id: str) -> str:
     res1 = soup.find(id=id).getText().strip()
     return res1
 
+def index_ids(soup: BeautifulSoup) -> Dict[str, element.Tag]:
+    '''
+    Walks the soup once and returns all elements with an id by their id. Looking up many ids in this is much cheaper than calling soup.find for each. Like soup.find, the first element wins if an id is used twice.
+    '''
+    index = {}
+    for tag in soup.find_all(id=True):
+        index.setdefault(tag['id'], tag)
+    return index
+
 def yes_no_to_boolean(x: str) -> bool:
     if x == "Yes":
         return True
@@ -116,6 +268,57 @@ def parse_documents_table(table: BeautifulSoup):
         #TODO: Currently this catches both exceptions and when no documents are attached. But it should only catch the latter to fail fast.
     return attached_documents
 
+def parse_table(table: BeautifulSoup) -> pd.core.frame.DataFrame:
+    '''
+    Turns a table into a pandas dataframe with the last header row as column names. This works on the already parsed table, which is a lot faster than pd.read_html. Like pd.read_html, cells spanning several rows or columns are repeated in each of them, columns of numbers (also with "," as thousands separator) become numeric, and empty cells missing values.
+
+    A row that spans the whole table, like "No records found", is skipped. Any other row that doesn't fit the header raises a ValueError rather than being dropped.
+    '''
+    with Instrumentation.measure('parse', 'table'):
+        columns = __table_grid(table.find('thead').find_all('tr', recursive=False))[-1]
+        rows = []
+        for row in table.find('tbody').find_all('tr', recursive=False):
+            cells = row.find_all(['td', 'th'], recursive=False)
+            if len(columns) > 1 and len(cells) == 1 and int(cells[0].get('colspan', 1)) == len(columns):
+                continue
+            rows.append(row)
+        rows = __table_grid(rows)
+        for row in rows:
+            if len(row) != len(columns):
+                raise ValueError("A row of the table has %d cells instead of %d: %s" % (len(row), len(columns), row))
+        df = pd.DataFrame([[cell or None for cell in row] for row in rows], columns=columns)
+        for column in df.columns:
+            values = df[column].dropna()
+            if all(NUMBER_PATTERN.fullmatch(value) for value in values):
+                df[column] = pd.to_numeric(df[column].str.replace(',', '', regex=False))
+        return df
+
+def __table_grid(rows: List[element.Tag]) -> List[List[str]]:
+    # The text of every cell by row and column, with rowspan and colspan spelled out
+    grid = []
+    spanning = {}
+    for row in rows:
+        line = []
+        cells = iter(row.find_all(['td', 'th'], recursive=False))
+        while True:
+            if len(line) in spanning:
+                text, rows_left = spanning.pop(len(line))
+                if rows_left > 1:
+                    spanning[len(line)] = (text, rows_left - 1)
+                line.append(text)
+                continue
+            cell = next(cells, None)
+            if cell is None:
+                break
+            text = cell.getText().strip()
+            rowspan = int(cell.get('rowspan', 1))
+            for _ in range(int(cell.get('colspan', 1))):
+                if rowspan > 1:
+                    spanning[len(line)] = (text, rowspan - 1)
+                line.append(text)
+        grid.append(line)
+    return grid
+
 def separate_accordion_sections(soup: BeautifulSoup) -> Dict[str, BeautifulSoup]:
     '''
     Separate accordion sections as a dictionary of section name and section content
@@ -125,6 +328,6 @@ def separate_accordion_sections(soup: BeautifulSoup) -> Dict[str, BeautifulSoup]
         if heading.name != "h3":
             continue
         section_name = heading.getText().strip()
-        section_content = heading.nextSibling.nextSibling
+        section_content = heading.next_sibling.next_sibling
         accordion_sections[section_name] = section_content
     return accordion_sections
\ No newline at end of file
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class CachedPage:
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    fresh: bool
+
+
+class PageCache:
+    '''
+    A persistent cache for trial pages, stored in a single SQLite file and keyed by EUCT number and tab.
+
+    Pages younger than ttl seconds are used as they are. Older pages are revalidated: with ETag/Last-Modified if the portal sends them, otherwise through the last update date on the summary tab (see Trial). Once the stored pages exceed max_size bytes, the least recently used ones are evicted.
+
+    Anything with the same get/put/touch/invalidate methods can be passed to Trial as a cache instead.
+    '''
+
+    def __init__(self, path: str, ttl: float = 24*60*60, max_size: int = 500*1024*1024) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute('''CREATE TABLE IF NOT EXISTS pages (
+                number TEXT NOT NULL,
+                tab TEXT NOT NULL,
+                content BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (number, tab))''')
+
+    def get(self, number: str, tab: str) -> Optional[CachedPage]:
+        '''
+        Returns the cached page, or None if there is none. Check fresh on the result to see whether it needs revalidating.
+        '''
+        now = time.time()
+        with self.__lock, self.__connection:
+            row = self.__connection.execute('SELECT content, etag, last_modified, stored_at FROM pages WHERE number = ? AND tab = ?', (number, tab)).fetchone()
+            if row is None:
+                return None
+            self.__connection.execute('UPDATE pages SET accessed_at = ? WHERE number = ? AND tab = ?', (now, number, tab))
+        content, etag, last_modified, stored_at = row
+        return CachedPage(content=content, etag=etag, last_modified=last_modified, stored_at=stored_at, fresh=now - stored_at < self.ttl)
+
+    def put(self, number: str, tab: str, content: bytes, etag: str = None, last_modified: str = None) -> None:
+        now = time.time()
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)', (number, tab, content, etag, last_modified, now, now))
+            self.__evict()
+
+    def touch(self, number: str, tab: str) -> None:
+        '''
+        Marks a page as fresh again, after it has been revalidated.
+        '''
+        now = time.time()
+        with self.__lock, self.__connection:
+            self.__connection.execute('UPDATE pages SET stored_at = ?, accessed_at = ? WHERE number = ? AND tab = ?', (now, now, number, tab))
+
+    def invalidate(self, number: str, tab: str = None) -> None:
+        '''
+        Removes one tab of a trial, or all of them if tab is None.
+        '''
+        with self.__lock, self.__connection:
+            if tab is None:
+                self.__connection.execute('DELETE FROM pages WHERE number = ?', (number,))
+            else:
+                self.__connection.execute('DELETE FROM pages WHERE number = ? AND tab = ?', (number, tab))
+
+    def size(self) -> int:
+        '''
+        Returns the total size of all cached pages in bytes.
+        '''
+        with self.__lock:
+            return self.__connection.execute('SELECT COALESCE(SUM(LENGTH(content)), 0) FROM pages').fetchone()[0]
+
+    def __evict(self) -> None:
+        total = self.__connection.execute('SELECT COALESCE(SUM(LENGTH(content)), 0) FROM pages').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.__connection.execute('SELECT number, tab, LENGTH(content) FROM pages ORDER BY accessed_at').fetchall()
+        for number, tab, length in rows:
+            if total <= self.max_size:
+                break
+            self.__connection.execute('DELETE FROM pages WHERE number = ? AND tab = ?', (number, tab))
+            total -= length
+
+    def close(self) -> None:
+        self.__connection.close()
@@ -1,8 +1,10 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from typing import Literal
 
-@dataclass
+@dataclass(frozen=True)
 class Document:
+    # Trials can have hundreds of documents, so they shouldn't each carry a __dict__
+    __slots__ = ('url', 'title', 'filetype', 'documenttype')
     url: str
     title: str
     filetype: Literal['',
@@ -42,4 +44,8 @@ class Document:
         '''
         Returns True if the document is a full protocol that has been published, False otherwise.
         '''
-        return self.documenttype == "Protocol (for publication)" and self.url is not None
\ No newline at end of file
+        return self.documenttype == "Protocol (for publication)" and self.url is not None
+
+    def __reduce__(self):
+        # Frozen instances with __slots__ can't be restored by pickle's default way of setting attributes
+        return (Document, tuple(getattr(self, field.name) for field in fields(self)))
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
+from urllib.parse import urljoin
+import requests
+from . import CTIS
+from .Document import Document
+
+# Downloads are written to disk in chunks of this many bytes. A chunk that is only partly received when a transfer drops is fetched again, so this shouldn't be too big.
+CHUNK_SIZE = 64*1024
+
+
+class BandwidthLimit:
+    '''
+    Caps the combined speed of all downloads that share it to bytes_per_second.
+    '''
+
+    def __init__(self, bytes_per_second: float, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.bytes_per_second = bytes_per_second
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__lock = threading.Lock()
+        self.__next_free = 0.0
+
+    def consume(self, byte_count: int) -> None:
+        '''
+        Waits until byte_count more bytes fit into the limit.
+        '''
+        with self.__lock:
+            now = self.__clock()
+            self.__next_free = max(self.__next_free, now) + byte_count / self.bytes_per_second
+            wait = self.__next_free - now
+        if wait > 0:
+            self.__sleep(wait)
+
+
+def download_file(url: str, path: str, session: requests.Session = None, progress: Callable[[int, int], None] = None, sha256: str = None, retries: int = 3, limit: BandwidthLimit = None) -> str:
+    '''
+    Streams the file at url to path in chunks and returns its SHA-256 as a hex string.
+
+    The data first goes to path + ".part". If the transfer drops, it is resumed with an HTTP Range request, up to retries times. That also works across calls, so calling this again after a failure continues where the last call stopped.
+
+    progress is called after every chunk with the bytes downloaded so far and the total size (None if the server doesn't say). If sha256 is given and the file doesn't match it, the download is deleted and a ValueError is raised.
+    '''
+    session = session if session is not None else CTIS.default_session()
+    part_path = path + '.part'
+    for attempt in range(retries + 1):
+        try:
+            __download_part(url, part_path, session, progress, limit)
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+    digest = file_sha256(part_path)
+    if sha256 is not None and digest != sha256.lower():
+        os.remove(part_path)
+        raise ValueError("Checksum mismatch for " + url + ": expected " + sha256 + ", got " + digest)
+    os.replace(part_path, path)
+    return digest
+
+
+def __download_part(url: str, part_path: str, session: requests.Session, progress: Callable[[int, int], None], limit: BandwidthLimit) -> None:
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # Range and Content-Length count the bytes as sent, but the file gets them decoded, so they must not be compressed on the way
+    headers = {'Accept-Encoding': 'identity'}
+    if offset > 0:
+        headers['Range'] = 'bytes=%d-' % offset
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 416:
+            if __range_total(response) == offset:
+                # The previous attempt got everything, it just didn't get to finish up
+                return
+            # The part file doesn't fit the file on the server (anymore), so asking for the same range again would fail forever
+            os.remove(part_path)
+            raise requests.exceptions.ConnectionError("Cannot resume " + url + " at byte %d: %s" % (offset, response.headers.get('Content-Range', '')))
+        response.raise_for_status()
+        if response.status_code == 206 and __range_start(response) != offset:
+            # Appending this would corrupt the file, so the next attempt starts over
+            os.remove(part_path)
+            raise requests.exceptions.ConnectionError("Unexpected Content-Range for " + url + ": " + response.headers.get('Content-Range', ''))
+        if response.status_code != 206:
+            # The server ignored the Range header and sends the whole file
+            offset = 0
+        total = response.headers.get('Content-Length')
+        total = int(total) + offset if total is not None else None
+        with open(part_path, 'ab' if offset > 0 else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                offset += len(chunk)
+                if limit is not None:
+                    limit.consume(len(chunk))
+                if progress is not None:
+                    progress(offset, total)
+
+
+def __range_total(response: requests.Response) -> int:
+    # A 416 response says how big the file is in a header like "Content-Range: bytes */12345"
+    content_range = response.headers.get('Content-Range', '')
+    total = content_range.rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def __range_start(response: requests.Response) -> int:
+    # A 206 response says which part of the file it has in a header like "Content-Range: bytes 100-12344/12345"
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match is not None else None
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_many(downloads: List[Tuple[str, str]], workers: int = 4, max_bytes_per_second: float = None, session: requests.Session = None, retries: int = 3) -> Dict[str, Union[str, Exception]]:
+    '''
+    Downloads (url, path) pairs concurrently with download_file, with at most workers at a time and, if max_bytes_per_second is given, at most that much bandwidth in total.
+
+    Returns a dictionary from each path to the SHA-256 of the file, or to the exception if that download failed. One failed download does not stop the others.
+    '''
+    session = session if session is not None else CTIS.new_session(workers)
+    limit = BandwidthLimit(max_bytes_per_second) if max_bytes_per_second is not None else None
+
+    def download(url_and_path: Tuple[str, str]) -> Union[str, Exception]:
+        url, path = url_and_path
+        try:
+            return download_file(url, path, session=session, retries=retries, limit=limit)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(download, downloads))
+    return {path: result for (url, path), result in zip(downloads, results)}
+
+
+def fetch_documents(documents: List[Document], store: str, workers: int = 4, max_bytes_per_second: float = None, session: requests.Session = None) -> Dict[str, Union[str, Exception]]:
+    '''
+    Downloads documents into a content-addressed store: each file is saved as store/<first two characters of its SHA-256>/<SHA-256>, so a document attached to many trials is only stored once.
+
+    store/manifest.json records the hash and the metadata of every document by URL. Documents that are in the manifest already (and whose file still exists) are skipped, as are documents without a URL.
+
+    Returns a dictionary from each URL to the path of its file, or to the exception if that download failed.
+    '''
+    manifest_path = os.path.join(store, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    os.makedirs(os.path.join(store, 'incoming'), exist_ok=True)
+
+    results = {}
+    missing = {}
+    for document in documents:
+        if document.url is None:
+            continue
+        url = urljoin(CTIS.BASE_URI, document.url)
+        if url in manifest and os.path.exists(os.path.join(store, manifest[url]['path'])):
+            results[url] = os.path.join(store, manifest[url]['path'])
+        else:
+            missing[url] = document
+
+    # Files are named after their URL until the download is done, so an interrupted download resumes on the next call
+    incoming = {url: os.path.join(store, 'incoming', hashlib.sha256(url.encode('utf-8')).hexdigest()) for url in missing}
+    digests = download_many([(url, incoming[url]) for url in missing], workers=workers, max_bytes_per_second=max_bytes_per_second, session=session)
+    for url, document in missing.items():
+        digest = digests[incoming[url]]
+        if isinstance(digest, Exception):
+            results[url] = digest
+            continue
+        path = os.path.join(digest[:2], digest)
+        os.makedirs(os.path.join(store, digest[:2]), exist_ok=True)
+        os.replace(incoming[url], os.path.join(store, path))
+        manifest[url] = {'sha256': digest, 'path': path, 'title': document.title, 'filetype': document.filetype, 'documenttype': document.documenttype}
+        results[url] = os.path.join(store, path)
+
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return results
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Set, Tuple
+import pandas as pd
+from .Registry import Registry, SCALAR_FIELDS
+from .TrialRecord import TrialRecord
+
+# Fields that can be filtered on by value. member_state is looked up in member_states_concerned, so a trial can have several.
+CATEGORICAL_FIELDS = ['member_state', 'phase', 'therapeutic_area', 'sponsor', 'is_low_intervention']
+# Fields that can be filtered on by a range of dates
+DATE_RANGE_FIELDS = ['first_submitted_date', 'last_update_date']
+
+
+class TrialIndex:
+    '''
+    An in-memory index over trial records, for filtering the whole registry without touching the portal or creating Trial objects.
+
+    Every field in CATEGORICAL_FIELDS has an inverted index from each value to the EUCT numbers with it, and every field in DATE_RANGE_FIELDS a sorted array that is searched with bisect. Build one from a Registry with from_registry, or from any TrialRecords.
+    '''
+
+    def __init__(self, records: Iterable[TrialRecord]) -> None:
+        self.__records = {record.EUCTNUMBER: record for record in records}
+        self.__inverted = {field: {} for field in CATEGORICAL_FIELDS}
+        for number, record in self.__records.items():
+            for field in CATEGORICAL_FIELDS:
+                values = record.member_states_concerned if field == 'member_state' else [getattr(record, field)]
+                for value in values:
+                    self.__inverted[field].setdefault(value, set()).add(number)
+        self.__dates = {}
+        for field in DATE_RANGE_FIELDS:
+            pairs = sorted((getattr(record, field), number) for number, record in self.__records.items() if getattr(record, field) is not None)
+            self.__dates[field] = ([day for day, number in pairs], [number for day, number in pairs])
+        self.__frame = pd.DataFrame([[getattr(record, field) for field in SCALAR_FIELDS] for record in self.__records.values()], index=pd.Index(list(self.__records), name='EUCTNUMBER'), columns=SCALAR_FIELDS)
+
+    @classmethod
+    def from_registry(cls, registry: Registry) -> TrialIndex:
+        return cls(registry.records())
+
+    def __len__(self) -> int:
+        return len(self.__records)
+
+    def values(self, field: str) -> Dict[object, int]:
+        '''
+        Returns every value of a field in CATEGORICAL_FIELDS with the number of trials that have it.
+        '''
+        if field not in self.__inverted:
+            raise ValueError("Unknown field: " + field)
+        return {value: len(numbers) for value, numbers in self.__inverted[field].items()}
+
+    def query(self, first_submitted_date: Tuple[date, date] = None, last_update_date: Tuple[date, date] = None, **filters) -> List[str]:
+        '''
+        Returns the sorted EUCT numbers of the trials that match all filters.
+
+        Keyword arguments are fields in CATEGORICAL_FIELDS. Each takes a value, or a list or set of values of which a trial must have any. The date fields take a (start, end) tuple, both inclusive, where either end may be None.
+
+            index.query(member_state='Austria', phase=['Therapeutic exploratory (Phase II)', 'Therapeutic confirmatory (Phase III)'], first_submitted_date=(date(2023, 1, 1), None))
+        '''
+        matches = []
+        for field, wanted in filters.items():
+            if field not in self.__inverted:
+                raise ValueError("Unknown field: " + field)
+            wanted = wanted if isinstance(wanted, (list, tuple, set, frozenset)) else [wanted]
+            matches.append(set().union(*(self.__inverted[field].get(value, set()) for value in wanted)))
+        for field, bounds in [('first_submitted_date', first_submitted_date), ('last_update_date', last_update_date)]:
+            if bounds is not None:
+                matches.append(self.__date_range(field, *bounds))
+        if not matches:
+            return sorted(self.__records)
+        # Intersecting starting from the smallest set keeps the work proportional to the result
+        matches.sort(key=len)
+        return sorted(matches[0].intersection(*matches[1:]))
+
+    def __date_range(self, field: str, start: date = None, end: date = None) -> Set[str]:
+        days, numbers = self.__dates[field]
+        low = bisect_left(days, start) if start is not None else 0
+        high = bisect_right(days, end) if end is not None else len(days)
+        return set(numbers[low:high])
+
+    def frame(self, **filters) -> pd.core.frame.DataFrame:
+        '''
+        Returns the scalar fields of the trials that match query(**filters) as a pandas dataframe indexed by EUCT number.
+        '''
+        return self.__frame.loc[self.query(**filters)]
+
+    def records(self, **filters) -> List[TrialRecord]:
+        return [self.__records[number] for number in self.query(**filters)]
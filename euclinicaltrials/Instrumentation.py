@@ -0,0 +1,149 @@
+from __future__ import annotations
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+import pandas as pd
+
+
+@dataclass
+class Event:
+    '''
+    One measured step. kind is one of:
+
+    - "request": an HTTP request through a PortalSession, named after its method. retries counts the attempts after the first one, and bytes is the size of the response body (for streamed responses, its Content-Length).
+    - "parse": turning a page into something usable, named "soup", "table" or "search page" (the last one includes reading the streamed response).
+    - "extract": an accessor of Trial, named after it, while building a TrialRecord or in Trial.load_many.
+    - "cache": a page looked up in a PageCache, named "hit", "miss" or "revalidated", with no duration.
+
+    Steps can contain each other: an extract that needs a page that isn't loaded yet includes the request and the parse.
+    '''
+    kind: str
+    name: str
+    duration: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    status: Optional[int] = None
+    url: Optional[str] = None
+
+
+# Everything that is called with each Event. Use add_listener or listening instead of changing this directly.
+LISTENERS: List[Callable[[Event], None]] = []
+__lock = threading.Lock()
+
+
+def add_listener(listener: Callable[[Event], None]) -> None:
+    '''
+    Starts calling listener with every Event, from whichever thread the step ran in.
+    '''
+    global LISTENERS
+    with __lock:
+        # Replaced rather than changed, so emit can go through the list without a lock
+        LISTENERS = LISTENERS + [listener]
+
+
+def remove_listener(listener: Callable[[Event], None]) -> None:
+    global LISTENERS
+    with __lock:
+        LISTENERS = [l for l in LISTENERS if l is not listener]
+
+
+@contextmanager
+def listening(listener: Callable[[Event], None]) -> Iterator[Callable[[Event], None]]:
+    '''
+    Calls listener with every Event inside the with block.
+    '''
+    add_listener(listener)
+    try:
+        yield listener
+    finally:
+        remove_listener(listener)
+
+
+def emit(event: Event) -> None:
+    for listener in LISTENERS:
+        listener(event)
+
+
+@contextmanager
+def measure(kind: str, name: str, **fields) -> Iterator[Event]:
+    '''
+    Times the with block and emits it as an Event. The block can fill in the other fields of the event it gets. Without listeners, nothing is timed.
+    '''
+    event = Event(kind, name, **fields)
+    if not LISTENERS:
+        yield event
+        return
+    start = time.perf_counter()
+    try:
+        yield event
+    finally:
+        event.duration = time.perf_counter() - start
+        emit(event)
+
+
+def count(kind: str, name: str, **fields) -> None:
+    '''
+    Emits an Event for something that happened, but takes no time worth measuring.
+    '''
+    if LISTENERS:
+        emit(Event(kind, name, **fields))
+
+
+class Profile:
+    '''
+    Adds up Events by kind and name. Use it as a context manager to collect everything inside the with block:
+
+        with Profile() as profile:
+            Trial.load_many(numbers)
+        profile.dump()
+    '''
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__stats: Dict[Tuple[str, str], List[float]] = {}
+
+    def __call__(self, event: Event) -> None:
+        with self.__lock:
+            stats = self.__stats.setdefault((event.kind, event.name), [0, 0.0, 0.0, 0, 0])
+            stats[0] += 1
+            stats[1] += event.duration
+            stats[2] = max(stats[2], event.duration)
+            stats[3] += event.bytes
+            stats[4] += event.retries
+
+    def __enter__(self) -> Profile:
+        add_listener(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        remove_listener(self)
+
+    def summary(self) -> pd.core.frame.DataFrame:
+        '''
+        Returns a pandas dataframe with a row per kind and name of step, with their count, their total, mean and longest duration in seconds, the bytes transferred and the retries.
+        '''
+        with self.__lock:
+            rows = [[kind, name, int(n), total, total / n, longest, int(byte_count), int(retries)] for (kind, name), (n, total, longest, byte_count, retries) in sorted(self.__stats.items())]
+        return pd.DataFrame(rows, columns=['kind', 'name', 'count', 'total_seconds', 'mean_seconds', 'max_seconds', 'bytes', 'retries']).set_index(['kind', 'name'])
+
+    def cache_hit_rate(self) -> Optional[float]:
+        '''
+        Returns the share of cache lookups that didn't need a full download (hits and revalidated pages), or None if there were none.
+        '''
+        with self.__lock:
+            hits = sum(self.__stats.get(('cache', name), [0])[0] for name in ['hit', 'revalidated'])
+            misses = self.__stats.get(('cache', 'miss'), [0])[0]
+        return hits / (hits + misses) if hits + misses > 0 else None
+
+    def dump(self, file: TextIO = None) -> None:
+        '''
+        Prints the summary, by default to stdout.
+        '''
+        file = file if file is not None else sys.stdout
+        print(self.summary().to_string(), file=file)
+        hit_rate = self.cache_hit_rate()
+        if hit_rate is not None:
+            print("Cache hit rate: %.1f%%" % (100 * hit_rate), file=file)
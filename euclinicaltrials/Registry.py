@@ -0,0 +1,187 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional, Set, Tuple
+import pandas as pd
+import requests
+from . import CTIS
+from .Cache import PageCache
+from .Document import Document
+from .Trial import Trial
+from .TrialRecord import TrialRecord
+
+# The columns of the trials table, in the order of TrialRecord. The rest of a record goes into the other tables.
+SCALAR_FIELDS = ['scope', 'sponsor', 'conditions', 'population_type', 'description', 'therapeutic_area', 'phase', 'is_low_intervention', 'is_transition_trial', 'is_medical_device', 'first_submitted_date', 'last_update_date', 'total_planned_subjects', 'is_protocol_published']
+BOOLEAN_FIELDS = {'is_low_intervention', 'is_transition_trial', 'is_medical_device', 'is_protocol_published'}
+DATE_FIELDS = {'first_submitted_date', 'last_update_date'}
+
+
+class Registry:
+    '''
+    A local snapshot of the whole registry in an SQLite file, kept up to date with sync().
+
+    The table trials has one row per trial with the scalar fields of TrialRecord. member_states, planned_subjects and documents have the rest, with a row per member state, country and document. Query them with SQL, or get a dataframe from frame() (which can be written to Parquet with its to_parquet).
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.executescript('''
+                CREATE TABLE IF NOT EXISTS trials (
+                    EUCTNUMBER TEXT PRIMARY KEY,
+                    scope TEXT, sponsor TEXT, conditions TEXT, population_type TEXT, description TEXT, therapeutic_area TEXT, phase TEXT,
+                    is_low_intervention INTEGER, is_transition_trial INTEGER, is_medical_device INTEGER,
+                    first_submitted_date TEXT, last_update_date TEXT,
+                    total_planned_subjects INTEGER, is_protocol_published INTEGER,
+                    synced_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS member_states (
+                    EUCTNUMBER TEXT NOT NULL, position INTEGER NOT NULL, member_state TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS planned_subjects (
+                    EUCTNUMBER TEXT NOT NULL, country TEXT NOT NULL, subjects INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS documents (
+                    EUCTNUMBER TEXT NOT NULL, part INTEGER NOT NULL, country TEXT, position INTEGER NOT NULL,
+                    url TEXT, title TEXT, filetype TEXT, documenttype TEXT);
+                CREATE INDEX IF NOT EXISTS member_states_by_trial ON member_states (EUCTNUMBER);
+                CREATE INDEX IF NOT EXISTS planned_subjects_by_trial ON planned_subjects (EUCTNUMBER);
+                CREATE INDEX IF NOT EXISTS documents_by_trial ON documents (EUCTNUMBER);
+            ''')
+
+    def put(self, record: TrialRecord) -> None:
+        '''
+        Adds a trial to the snapshot, or replaces it.
+        '''
+        values = [getattr(record, field) for field in SCALAR_FIELDS]
+        values = [value.isoformat() if isinstance(value, date) else value for value in values]
+        with self.__lock, self.__connection:
+            self.__delete(record.EUCTNUMBER)
+            self.__connection.execute('INSERT INTO trials VALUES (%s)' % ', '.join(['?'] * (len(SCALAR_FIELDS) + 2)), [record.EUCTNUMBER] + values + [time.time()])
+            self.__connection.executemany('INSERT INTO member_states VALUES (?, ?, ?)', [(record.EUCTNUMBER, i, member_state) for i, member_state in enumerate(record.member_states_concerned)])
+            self.__connection.executemany('INSERT INTO planned_subjects VALUES (?, ?, ?)', [(record.EUCTNUMBER, country, subjects) for country, subjects in record.planned_subjects_by_country])
+            documents = [(1, None, document) for document in record.documents_part_1]
+            documents += [(2, country, document) for country, country_documents in record.documents_part_2 for document in country_documents]
+            self.__connection.executemany('INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(record.EUCTNUMBER, part, country, i, document.url, document.title, document.filetype, document.documenttype) for i, (part, country, document) in enumerate(documents)])
+
+    def remove(self, EUCTNUMBER: str) -> None:
+        with self.__lock, self.__connection:
+            self.__delete(EUCTNUMBER)
+
+    def __delete(self, EUCTNUMBER: str) -> None:
+        for table in ['trials', 'member_states', 'planned_subjects', 'documents']:
+            self.__connection.execute('DELETE FROM %s WHERE EUCTNUMBER = ?' % table, (EUCTNUMBER,))
+
+    def get(self, EUCTNUMBER: str) -> Optional[TrialRecord]:
+        '''
+        Returns the snapshot of a trial, or None if it isn't in the registry.
+        '''
+        records = self.__load('WHERE EUCTNUMBER = ?', (EUCTNUMBER,))
+        return records[0] if records else None
+
+    def records(self) -> List[TrialRecord]:
+        '''
+        Returns the snapshots of all trials, sorted by EUCT number. Each table is read only once, however many trials there are.
+        '''
+        return self.__load()
+
+    def __load(self, where: str = '', parameters: tuple = ()) -> List[TrialRecord]:
+        with self.__lock:
+            rows = self.__connection.execute('SELECT * FROM trials %s ORDER BY EUCTNUMBER' % where, parameters).fetchall()
+            member_states = self.__connection.execute('SELECT EUCTNUMBER, member_state FROM member_states %s ORDER BY EUCTNUMBER, position' % where, parameters).fetchall()
+            planned_subjects = self.__connection.execute('SELECT EUCTNUMBER, country, subjects FROM planned_subjects %s ORDER BY EUCTNUMBER, rowid' % where, parameters).fetchall()
+            documents = self.__connection.execute('SELECT EUCTNUMBER, part, country, url, title, filetype, documenttype FROM documents %s ORDER BY EUCTNUMBER, position' % where, parameters).fetchall()
+        member_states_by_trial = {}
+        for EUCTNUMBER, member_state in member_states:
+            member_states_by_trial.setdefault(EUCTNUMBER, []).append(member_state)
+        planned_subjects_by_trial = {}
+        for EUCTNUMBER, country, subjects in planned_subjects:
+            planned_subjects_by_trial.setdefault(EUCTNUMBER, []).append((country, subjects))
+        documents_part_1 = {}
+        documents_part_2 = {}
+        for EUCTNUMBER, part, country, url, title, filetype, documenttype in documents:
+            document = Document(url=url, title=title, filetype=filetype, documenttype=documenttype)
+            if part == 1:
+                documents_part_1.setdefault(EUCTNUMBER, []).append(document)
+            else:
+                documents_part_2.setdefault(EUCTNUMBER, {}).setdefault(country, []).append(document)
+        records = []
+        for row in rows:
+            EUCTNUMBER = row[0]
+            values = dict(zip(SCALAR_FIELDS, row[1:-1]))
+            for field in BOOLEAN_FIELDS:
+                values[field] = bool(values[field])
+            for field in DATE_FIELDS:
+                values[field] = date.fromisoformat(values[field])
+            records.append(TrialRecord(
+                EUCTNUMBER=EUCTNUMBER,
+                member_states_concerned=tuple(member_states_by_trial.get(EUCTNUMBER, [])),
+                planned_subjects_by_country=tuple(planned_subjects_by_trial.get(EUCTNUMBER, [])),
+                documents_part_1=tuple(documents_part_1.get(EUCTNUMBER, [])),
+                documents_part_2=tuple((country, tuple(country_documents)) for country, country_documents in documents_part_2.get(EUCTNUMBER, {}).items()),
+                **values))
+        return records
+
+    def numbers(self) -> Set[str]:
+        with self.__lock:
+            return {EUCTNUMBER for EUCTNUMBER, in self.__connection.execute('SELECT EUCTNUMBER FROM trials')}
+
+    def last_update_dates(self) -> Dict[str, date]:
+        with self.__lock:
+            return {EUCTNUMBER: date.fromisoformat(last_update_date) for EUCTNUMBER, last_update_date in self.__connection.execute('SELECT EUCTNUMBER, last_update_date FROM trials')}
+
+    def frame(self) -> pd.core.frame.DataFrame:
+        '''
+        Returns the trials table as a pandas dataframe indexed by EUCT number.
+        '''
+        with self.__lock:
+            df = pd.read_sql_query('SELECT * FROM trials ORDER BY EUCTNUMBER', self.__connection, index_col='EUCTNUMBER')
+        for field in BOOLEAN_FIELDS:
+            df[field] = df[field].astype(bool)
+        for field in DATE_FIELDS:
+            df[field] = pd.to_datetime(df[field]).dt.date
+        return df.drop(columns='synced_at')
+
+    def sync(self, workers: int = 8, session: requests.Session = None, cache: PageCache = None, page_size: int = 20) -> Dict[str, object]:
+        '''
+        Brings the snapshot up to date with the portal.
+
+        All trial numbers are listed first, and trials that aren't listed anymore are removed. New trials are loaded completely. For the ones already in the snapshot, only the summary tab is loaded, and the rest only if the last update date on it moved.
+
+        So a sync costs one search request per page_size trials on the portal, one summary request per trial in the snapshot, and one more request per new or updated trial. With a cache, summaries younger than its ttl aren't requested at all (so updates show up once they expire), and older ones are revalidated with conditional requests if the portal sends ETag or Last-Modified.
+
+        Returns the EUCT numbers by what happened to them: "new", "updated", "unchanged" and "removed" are lists, "failed" is a dictionary from each trial that failed to the error message. Failed trials keep their old snapshot, if any.
+        '''
+        session = session if session is not None else CTIS.new_session(workers)
+        known = self.last_update_dates()
+
+        def check(EUCTNUMBER: str) -> Tuple[str, object]:
+            try:
+                with Trial(EUCTNUMBER, session=session, cache=cache) as trial:
+                    if EUCTNUMBER in known and trial.last_update_date() == known[EUCTNUMBER]:
+                        return 'unchanged', None
+                    return ('updated' if EUCTNUMBER in known else 'new'), trial.to_record()
+            except Exception as e:
+                return 'failed', type(e).__name__ + ": " + str(e)
+
+        numbers = CTIS.get_all_trial_numbers(workers=workers, session=session, page_size=page_size)
+        result = {'new': [], 'updated': [], 'unchanged': [], 'removed': [], 'failed': {}}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # The snapshot is only written from this thread
+            for EUCTNUMBER, (outcome, value) in zip(numbers, executor.map(check, numbers)):
+                if outcome == 'failed':
+                    result['failed'][EUCTNUMBER] = value
+                    continue
+                if value is not None:
+                    self.put(value)
+                result[outcome].append(EUCTNUMBER)
+        listed = set(numbers)
+        for EUCTNUMBER in sorted(set(known) - listed):
+            self.remove(EUCTNUMBER)
+            result['removed'].append(EUCTNUMBER)
+        return result
+
+    def close(self) -> None:
+        self.__connection.close()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import hashlib
+import io
+import json
+import os
+from typing import Dict, Iterator, Tuple
+import requests
+import urllib3
+from .Transport import PortalSession
+
+# Headers that describe how the body went over the wire. Recordings store the decoded body, so these don't apply to it anymore.
+TRANSFER_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive'}
+
+
+def recording_key(method: str, url: str, body: bytes = None) -> str:
+    digest = hashlib.sha256()
+    digest.update(method.upper().encode('utf-8') + b' ' + url.encode('utf-8') + b'\n')
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def save_recording(directory: str, method: str, url: str, content: bytes, body: bytes = None, status: int = 200, headers: Dict[str, str] = {}) -> None:
+    '''
+    Stores a response in directory, as if it had been recorded. This is also how RecordReplayAdapter stores what it records.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    key = recording_key(method, url, body)
+    with open(os.path.join(directory, key + '.body'), 'wb') as f:
+        f.write(content)
+    meta = {'method': method.upper(), 'url': url, 'status': status, 'headers': {k: v for k, v in headers.items() if k.lower() not in TRANSFER_HEADERS}}
+    with open(os.path.join(directory, key + '.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+def recordings(directory: str) -> Iterator[Tuple[str, str]]:
+    '''
+    Yields the method and URL of every recording in directory.
+    '''
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                meta = json.load(f)
+            yield meta['method'], meta['url']
+
+
+class RecordReplayAdapter(requests.adapters.HTTPAdapter):
+    '''
+    A transport that records responses from the portal to a directory, or serves them from there without touching the network.
+
+    In "record" mode, requests go out as usual and every response is stored. In "replay" mode, responses come from the directory only, and a request without a recording raises a ConnectionError. Requests are told apart by method, URL and body, so paging through the search works too.
+    '''
+
+    def __init__(self, directory: str, mode: str = 'replay', **kwargs) -> None:
+        if mode not in ('record', 'replay'):
+            raise ValueError("Unexpected mode: " + mode)
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.mode = mode
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        body = request.body.encode('utf-8') if isinstance(request.body, str) else request.body
+        if self.mode == 'record':
+            response = super().send(request, **kwargs)
+            save_recording(self.directory, request.method, request.url, response.content, body=body, status=response.status_code, headers=response.headers)
+        key = recording_key(request.method, request.url, body)
+        try:
+            with open(os.path.join(self.directory, key + '.json')) as f:
+                meta = json.load(f)
+            with open(os.path.join(self.directory, key + '.body'), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            raise requests.exceptions.ConnectionError("No recording for " + request.method + " " + request.url, request=request)
+        headers = dict(meta['headers'])
+        headers['Content-Length'] = str(len(content))
+        raw = urllib3.HTTPResponse(body=io.BytesIO(content), headers=headers, status=meta['status'], preload_content=False, decode_content=False)
+        return self.build_response(request, raw)
+
+
+def replay_session(directory: str, mode: str = 'replay', pool_size: int = 10) -> requests.Session:
+    '''
+    Creates a session like CTIS.new_session, but that records to or replays from directory. Pass it to Trial, CTIS.get_all_trial_numbers and so on.
+
+    Recording goes to the portal, so it is rate limited and retried like any other PortalSession. Replaying never leaves the machine and skips all that.
+    '''
+    session = PortalSession() if mode == 'record' else requests.Session()
+    adapter = RecordReplayAdapter(directory, mode, pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable
+import requests
+from . import CTIS, Instrumentation
+
+# Responses with these status codes are retried, since they usually mean the portal is overloaded or restarting
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    '''
+    A token bucket: allows rate requests per second on average, and bursts of up to burst requests at once.
+    '''
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__lock = threading.Lock()
+        self.__tokens = float(burst)
+        self.__updated = clock()
+
+    def acquire(self) -> None:
+        '''
+        Waits until a request may be made.
+        '''
+        with self.__lock:
+            now = self.__clock()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            # Taking the token right away, even if that goes below zero, reserves the next free slot for this request
+            self.__tokens -= 1
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0
+        if wait > 0:
+            self.__sleep(wait)
+
+
+class CircuitBreaker:
+    '''
+    Pauses all requests while the portal is known to be down.
+
+    After failure_threshold failed requests in a row, requests wait for reset_timeout seconds before trying again. If pause_for_maintenance is set, requests also wait during the scheduled maintenance windows (see CTIS.is_maintenace_window) and go on once they are over.
+    '''
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60, pause_for_maintenance: bool = True, maintenance_poll: float = 60, clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pause_for_maintenance = pause_for_maintenance
+        self.maintenance_poll = maintenance_poll
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__open_until = 0.0
+
+    def is_open(self) -> bool:
+        '''
+        Returns True if requests should wait right now.
+        '''
+        return self.__wait_time() > 0
+
+    def __wait_time(self) -> float:
+        now = self.__clock()
+        with self.__lock:
+            wait = self.__open_until - now
+        if wait <= 0 and self.pause_for_maintenance:
+            if CTIS.is_maintenace_window(datetime.fromtimestamp(now, timezone.utc)):
+                wait = self.maintenance_poll
+        return max(wait, 0)
+
+    def wait(self) -> None:
+        '''
+        Waits until the breaker is closed.
+        '''
+        wait = self.__wait_time()
+        while wait > 0:
+            self.__sleep(wait)
+            wait = self.__wait_time()
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.__failures = 0
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            if self.__failures >= self.failure_threshold:
+                self.__open_until = self.__clock() + self.reset_timeout
+                self.__failures = 0
+
+
+# Shared by all PortalSessions that aren't given their own, so all requests to the portal count against the same limits
+RATE_LIMITER = RateLimiter(rate=10, burst=10)
+CIRCUIT_BREAKER = CircuitBreaker()
+
+
+class PortalSession(requests.Session):
+    '''
+    A session for requests to the portal. Every request waits for the circuit breaker and the rate limiter, has a timeout, and is retried with jittered exponential backoff on connection errors and on the statuses in RETRY_STATUSES.
+
+    Like requests.Session, it returns error responses instead of raising, including the last one once the retries are used up. Callers check the status with raise_for_status() before using a response.
+
+    rate_limiter and circuit_breaker default to the shared RATE_LIMITER and CIRCUIT_BREAKER of this module. Each request is reported to Instrumentation, with its retries, as a single Event.
+    '''
+
+    def __init__(self, rate_limiter: RateLimiter = None, circuit_breaker: CircuitBreaker = None, retries: int = 4, backoff: float = 1, max_backoff: float = 60, timeout: tuple = (10, 300), sleep: Callable[[float], None] = time.sleep, jitter: Callable[[float, float], float] = random.uniform) -> None:
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.__sleep = sleep
+        self.__jitter = jitter
+
+    def request(self, method: str, url: str, *args, **kwargs) -> requests.Response:
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        rate_limiter = self.rate_limiter if self.rate_limiter is not None else RATE_LIMITER
+        circuit_breaker = self.circuit_breaker if self.circuit_breaker is not None else CIRCUIT_BREAKER
+        with Instrumentation.measure('request', method.upper(), url=url) as event:
+            for attempt in range(self.retries + 1):
+                event.retries = attempt
+                circuit_breaker.wait()
+                rate_limiter.acquire()
+                try:
+                    response = super().request(method, url, *args, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    circuit_breaker.record_failure()
+                    if attempt == self.retries:
+                        raise
+                    self.__sleep(self.__backoff(attempt))
+                    continue
+                event.status = response.status_code
+                if response.status_code not in RETRY_STATUSES:
+                    circuit_breaker.record_success()
+                    event.bytes = PortalSession.__body_size(response, kwargs.get('stream', False))
+                    return response
+                circuit_breaker.record_failure()
+                if attempt == self.retries:
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                response.close()
+                self.__sleep(float(retry_after) if retry_after.isdigit() else self.__backoff(attempt))
+
+    @staticmethod
+    def __body_size(response: requests.Response, stream: bool) -> int:
+        # A streamed body isn't read yet, so this can only go by what the server announced
+        if stream:
+            length = response.headers.get('Content-Length', '')
+            return int(length) if length.isdigit() else 0
+        return len(response.content)
+
+    def __backoff(self, attempt: int) -> float:
+        return self.__jitter(0, min(self.max_backoff, self.backoff * 2 ** attempt))
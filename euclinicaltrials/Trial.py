@@ -1,75 +1,243 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Dict, Type
+from typing import List, Dict, Tuple, Type, Callable
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from bs4 import BeautifulSoup
-from . import CTIS, Document
+from bs4 import BeautifulSoup, SoupStrainer, element
+from . import CTIS, Document, Instrumentation
+from .Cache import PageCache
+from .TrialRecord import TrialRecord
+from .Download import download_file
 import pandas as pd
 
 
 
 class Trial:
     EUCTNUMBER: str
-    __soup_full_cache: BeautifulSoup
-    __soup_results_cache: BeautifulSoup
-    __soup_summary_cache: BeautifulSoup
-    
-    def __init__(self, EUCTNUMBER:str) -> None:
+    __session: requests.Session
+    __cache: PageCache
+    __soups: Dict[str, BeautifulSoup]
+    __ids: Dict[str, Dict[str, element.Tag]]
+    __derived: Dict[str, object]
+    __preloaded: Dict[str, bytes]
+    __parsing: Tuple[str, SoupStrainer]
+
+    # The tabs of a trial's page on the portal, by the name of their view
+    TABS = ['fullInformation', 'summary', 'trialResults']
+
+    # The fields load_many returns by default: everything with a single value
+    FIELDS = ['scope', 'sponsor', 'conditions', 'population_type', 'description', 'therapeutic_area', 'phase', 'is_low_intervention', 'is_transition_trial', 'is_medical_device', 'first_submitted_date', 'last_update_date', 'total_planned_subjects', 'is_protocol_published']
+
+    # All fields load_many accepts: the ones above and those with lists, dictionaries or tables as values
+    ACCESSORS = FIELDS + ['member_states_concerned', 'planned_subjects_by_country', 'documents_part_1', 'documents_part_2', 'overall_trial_status_table', 'link']
+
+    def __init__(self, EUCTNUMBER:str, session: requests.Session = None, cache: PageCache = None) -> None:
+        '''
+        Pages are loaded through session if one is given, so several trials can share a connection pool. If a cache is given, pages are taken from and stored in it.
+        '''
         self.EUCTNUMBER = EUCTNUMBER
-        self.__soup_full_cache = None
-        self.__soup_results_cache = None
-        self.__soup_summary_cache = None
+        self.__session = session
+        self.__cache = cache
+        self.__soups = {}
+        self.__ids = {}
+        self.__derived = {}
+        self.__preloaded = {}
+        # None to use CTIS.PARSER and CTIS.PARSE_ONLY, as they are when a page is parsed
+        self.__parsing = None
+
+    
+    @classmethod
+    def from_pages(cls, EUCTNUMBER: str, pages: Dict[str, bytes], session: requests.Session = None, cache: PageCache = None, parser: str = None, parse_only: SoupStrainer = None) -> Trial:
+        '''
+        Creates a trial from pages that were loaded elsewhere, as a dictionary from tab (see Trial.TABS) to the page. Tabs that aren't given are loaded as usual.
+
+        If a parser is given, all pages are parsed with it and parse_only instead of CTIS.PARSER and CTIS.PARSE_ONLY.
+        '''
+        trial = cls(EUCTNUMBER, session=session, cache=cache)
+        trial.__preloaded = dict(pages)
+        if parser is not None:
+            trial.__parsing = (parser, parse_only)
+        return trial
+
+    
+    def __enter__(self) -> Trial:
+        return self
+
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    
+    def close(self) -> None:
+        '''
+        Releases the parsed pages. The trial can still be used afterwards, but pages will be loaded again when needed.
+        '''
+        self.__soups = {}
+        self.__ids = {}
+        self.__derived = {}
+
+    
+    def refresh(self) -> None:
+        '''
+        Forgets all pages of this trial, including those in the cache, so they are loaded from the website again when needed.
+        '''
+        if self.__cache is not None:
+            self.__cache.invalidate(self.EUCTNUMBER)
+        self.close()
+
+    
+    def to_record(self) -> TrialRecord:
+        '''
+        Extracts everything into a TrialRecord and releases the parsed pages. Use this to keep many trials in memory.
+        '''
+        record = TrialRecord(
+            EUCTNUMBER=self.EUCTNUMBER,
+            scope=self.__extract('scope'),
+            sponsor=self.__extract('sponsor'),
+            conditions=self.__extract('conditions'),
+            population_type=self.__extract('population_type'),
+            description=self.__extract('description'),
+            therapeutic_area=self.__extract('therapeutic_area'),
+            phase=self.__extract('phase'),
+            is_low_intervention=self.__extract('is_low_intervention'),
+            is_transition_trial=self.__extract('is_transition_trial'),
+            is_medical_device=self.__extract('is_medical_device'),
+            first_submitted_date=self.__extract('first_submitted_date'),
+            last_update_date=self.__extract('last_update_date'),
+            total_planned_subjects=self.__extract('total_planned_subjects'),
+            is_protocol_published=self.__extract('is_protocol_published'),
+            member_states_concerned=tuple(self.__extract('member_states_concerned')),
+            planned_subjects_by_country=tuple(self.__extract('planned_subjects_by_country').items()),
+            documents_part_1=tuple(self.__extract('documents_part_1')),
+            documents_part_2=tuple((country, tuple(documents)) for country, documents in self.__extract('documents_part_2').items()),
+        )
+        self.close()
+        return record
+
+    
+    def __extract(self, field: str) -> object:
+        with Instrumentation.measure('extract', field):
+            return getattr(self, field)()
+
+    
+    def tab_url(self, tab: str) -> str:
+        '''
+        This is the URL of one of the tabs in Trial.TABS. CTIS.trial_tab_url gives it without creating a Trial.
+        '''
+        return CTIS.trial_tab_url(self.EUCTNUMBER, tab)
 
     
-    def __soup_full(self):
-        if self.__soup_full_cache is None:
-            URL = CTIS.BASE_URI + '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2FfullInformation.xhtml'
-            page = requests.get(URL)
-            self.__soup_full_cache = BeautifulSoup(page.content, "html.parser")
-        return self.__soup_full_cache
+    def __http(self) -> requests.Session:
+        # The shared session is only created once something is actually loaded, so trials made from pages don't need one
+        return self.__session if self.__session is not None else CTIS.default_session()
 
     
-    def __soup_results(self):
-        if self.__soup_results_cache is None:
-            URL = CTIS.BASE_URI + '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2FtrialResults.xhtml'
-            page = requests.get(URL)
-            self.__soup_results_cache = BeautifulSoup(page.content, "html.parser")
-        return self.__soup_results_cache
+    def __fetch(self, tab: str) -> bytes:
+        if self.__cache is None:
+            response = self.__http().get(self.tab_url(tab))
+            response.raise_for_status()
+            return response.content
+        cached = self.__cache.get(self.EUCTNUMBER, tab)
+        if cached is not None and cached.fresh:
+            Instrumentation.count('cache', 'hit', bytes=len(cached.content), url=self.tab_url(tab))
+            return cached.content
+        if cached is not None and cached.etag is None and cached.last_modified is None and tab != 'summary':
+            # Without validators from the portal, the other tabs count as unchanged as long as the last update date on the summary stays the same. Loading the summary drops them from the cache otherwise.
+            self.__soup('summary')
+            if self.__cache.get(self.EUCTNUMBER, tab) is not None:
+                self.__cache.touch(self.EUCTNUMBER, tab)
+                Instrumentation.count('cache', 'revalidated', bytes=len(cached.content), url=self.tab_url(tab))
+                return cached.content
+            cached = None
+        headers = {}
+        if cached is not None and cached.etag is not None:
+            headers['If-None-Match'] = cached.etag
+        if cached is not None and cached.last_modified is not None:
+            headers['If-Modified-Since'] = cached.last_modified
+        response = self.__http().get(self.tab_url(tab), headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.__cache.touch(self.EUCTNUMBER, tab)
+            Instrumentation.count('cache', 'revalidated', bytes=len(cached.content), url=self.tab_url(tab))
+            return cached.content
+        # Error pages must neither be parsed nor cached, or they would be served as the trial until the TTL runs out
+        response.raise_for_status()
+        Instrumentation.count('cache', 'miss', bytes=len(response.content), url=self.tab_url(tab))
+        if tab == 'summary' and cached is not None and cached.content != response.content:
+            if self.__last_update(cached.content) != self.__last_update(response.content):
+                self.__cache.invalidate(self.EUCTNUMBER)
+        if response.status_code == 200:
+            self.__cache.put(self.EUCTNUMBER, tab, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content
 
     
-    def __soup_summary(self):
-        if self.__soup_summary_cache is None:
-            URL = CTIS.BASE_URI + '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2Fsummary.xhtml'
-            page = requests.get(URL)
-            self.__soup_summary_cache = BeautifulSoup(page.content, "html.parser")
-        return self.__soup_summary_cache
+    def __last_update(self, summary_page: bytes) -> str:
+        soup = self.__make_soup(summary_page)
+        return CTIS.get_content_by_id(soup, "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoLastUpdatedId")
+
+    
+    def __soup(self, tab: str) -> BeautifulSoup:
+        if tab not in self.__soups:
+            page = self.__preloaded.pop(tab) if tab in self.__preloaded else self.__fetch(tab)
+            self.__soups[tab] = self.__make_soup(page)
+        return self.__soups[tab]
+
+    
+    def __make_soup(self, page: bytes) -> BeautifulSoup:
+        if self.__parsing is None:
+            return CTIS.make_soup(page, CTIS.PARSE_ONLY)
+        parser, parse_only = self.__parsing
+        return CTIS.make_soup(page, parse_only, parser)
+
+    
+    def __by_id(self, tab: str, id: str) -> element.Tag:
+        if tab not in self.__ids:
+            self.__ids[tab] = CTIS.index_ids(self.__soup(tab))
+        return self.__ids[tab].get(id)
+
+    
+    def __content_by_id(self, tab: str, id: str) -> str:
+        return self.__by_id(tab, id).getText().strip()
+
+    
+    def __memo(self, name: str, build: Callable[[], object]) -> object:
+        # For structures that are expensive to derive from the pages. They are kept until the pages are released.
+        if name not in self.__derived:
+            self.__derived[name] = build()
+        return self.__derived[name]
+
+    
+    def __status_table(self) -> pd.core.frame.DataFrame:
+        trialStatusInfoDataTable = self.__by_id('summary', 'trialStatusInfoDataTableId')
+        return CTIS.parse_table(trialStatusInfoDataTable)
+
     
     def overall_trial_status_table(self) -> pd.core.frame.DataFrame:
         '''
         Returns a pandas dataframe of the overall trial status table (the big one on the Summary tab)
         '''
-        trialStatusInfoDataTable = self.__soup_summary().find(id='trialStatusInfoDataTableId')
-        df = pd.read_html(str(trialStatusInfoDataTable))[0]
-        df.columns = df.columns.droplevel(level=0)
-        return df
+        return self.__memo('status_table', self.__status_table).copy()
     
     
     def member_states_concerned(self) -> List[str]:
-        return list(self.overall_trial_status_table()['Member state'])
+        return list(self.__memo('status_table', self.__status_table)['Member state'])
     
     def documents_part_1(self) -> List[Type[Document]]:
         '''
         Returns a list of all documents attached trial specific information (Part I).
         '''
         attached_documents = []
-        productsDetails_tab = self.__soup_full().find(id='productsDetails')
+        productsDetails_tab = self.__by_id('fullInformation', 'productsDetails')
         trial_document_table = productsDetails_tab.next_sibling.next_sibling.next_sibling.next_sibling.table
         return CTIS.parse_documents_table(trial_document_table)
     
     
-    def __country_accordions(self) -> List[Type[BeautifulSoup]]:
-        trialStatusInfoDataTable = self.__soup_full().find(id='countrySpecificDetailsInfoAccordionId')
+    def __country_accordions(self) -> Dict[str, BeautifulSoup]:
+        return self.__memo('country_accordions', self.__separate_country_accordions)
+
+    
+    def __separate_country_accordions(self) -> Dict[str, BeautifulSoup]:
+        trialStatusInfoDataTable = self.__by_id('fullInformation', 'countrySpecificDetailsInfoAccordionId')
         separated = CTIS.separate_accordion_sections(trialStatusInfoDataTable)
         new_keys = {k.split("-")[0].strip(): v for k, v in separated.items()}
         return new_keys
@@ -109,7 +277,7 @@ class Trial:
     # Now for some properties that come neatly labeled
     
     def scope(self) -> str:
-        trial_scope = CTIS.get_content_by_id(self.__soup_full(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialScopeId")
+        trial_scope = self.__content_by_id('fullInformation', "_emactview_WAR_emactpublicportlet_:mainFormID:trialScopeId")
         return trial_scope
 
     
@@ -117,57 +285,57 @@ class Trial:
         '''
         This only returns the sponsor name. More information is on the website, but can also be retrieved from the EMA's SPOR database. That one does have an API!
         '''
-        sponsor = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoSponsorId")
+        sponsor = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoSponsorId")
         return sponsor
 
     
     def conditions(self) -> str:
-        conditions = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoConditionsId")
+        conditions = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoConditionsId")
         return conditions
 
     
     def population_type(self) -> str:
-        population_type = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoVulnerablePopulationsId")
+        population_type = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoVulnerablePopulationsId")
         return population_type
 
     
     def description(self) -> str:
-        description = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:ctPublicViewHeaderFornId:trialDescriptionId")
+        description = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:ctPublicViewHeaderFornId:trialDescriptionId")
         return description
 
     
     def therapeutic_area(self) -> str:
-        therapeutic_area = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoTherapeuticAreaId")
+        therapeutic_area = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoTherapeuticAreaId")
         return therapeutic_area
 
     
     def phase(self) -> str:
-        phase = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoTrialPhaseId")
+        phase = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoTrialPhaseId")
         return phase
 
     
     def is_low_intervention(self) -> bool:
-        is_low_intervention = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoLowInterStudyLabelNoId")
+        is_low_intervention = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoLowInterStudyLabelNoId")
         return CTIS.yes_no_to_boolean(is_low_intervention)
 
     
     def is_transition_trial(self) -> bool:
-        is_transition_trial = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:isTransitionedLabelNoId")
+        is_transition_trial = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:isTransitionedLabelNoId")
         return CTIS.yes_no_to_boolean(is_transition_trial)
 
     
     def is_medical_device(self) -> bool:
-        is_medical_device = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoMedicalDeviceLabelNoId")
+        is_medical_device = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoMedicalDeviceLabelNoId")
         return CTIS.yes_no_to_boolean(is_medical_device)
 
     
     def first_submitted_date(self) -> datetime.date:
-        first_submitted_date = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoFirstSumbittedId")
+        first_submitted_date = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoFirstSumbittedId")
         return CTIS.parse_CTIS_date(first_submitted_date)
 
     
     def last_update_date(self) -> datetime.date:
-        last_update_date = CTIS.get_content_by_id(self.__soup_summary(), "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoLastUpdatedId")
+        last_update_date = self.__content_by_id('summary', "_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoLastUpdatedId")
         return CTIS.parse_CTIS_date(last_update_date)
 
     
@@ -179,18 +347,67 @@ class Trial:
         return CTIS.BASE_URI + '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2Fsummary.xhtml'
 
     
+    def full_zip_url(self) -> str:
+        '''
+        This is the URL the full zip file is served from.
+
+        The portal's own download link also carries its internal id of the trial ("ctid") in the download options. That id doesn't appear on the pages this package reads, so it is left out, and it hasn't been checked yet whether the portal needs it.
+        '''
+        back_URL = '/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2FfullInformation.xhtml'
+        download_options = '{%22ctNumber%22:%22' + self.EUCTNUMBER + '%22,%22includeSummary%22:1,%22includeFullTrial%22:1,%22includeEvents%22:0,%22includeResults%22:0,%22includeCorrectiveMeasures%22:0,%22includeInspectionRecords%22:0,%22includeDocuments%22:1,%22includedApplications%22:[]}'
+        return CTIS.BASE_URI + '/download-clinical-trial?p_p_id=emactdownload_WAR_emactpublicportlet&p_p_lifecycle=2&p_p_state=normal&p_p_mode=view&p_p_cacheability=cacheLevelPage&p_p_col_id=column-1&p_p_col_count=1&_emactdownload_WAR_emactpublicportlet_cmd=downloadCT&_emactdownload_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactdownload_WAR_emactpublicportlet_backURL=' + back_URL + '&_emactdownload_WAR_emactpublicportlet_downloadOptions=' + download_options
+
+    
     def full_zip_download_link(self) -> str:
         '''
         This is a link to download the full zip file. For bigger trials, this can take more than a minute.
         '''
-        request_URL = CTIS.BASE_URI + '/download-clinical-trial?p_p_id=emactdownload_WAR_emactpublicportlet&p_p_lifecycle=2&p_p_state=normal&p_p_mode=view&p_p_cacheability=cacheLevelPage&p_p_col_id=column-1&p_p_col_count=1&_emactdownload_WAR_emactpublicportlet_cmd=downloadCT&_emactdownload_WAR_emactpublicportlet_number=' + self.EUCTNUMBER + '&_emactdownload_WAR_emactpublicportlet_number=2022-500137-89-00&_emactdownload_WAR_emactpublicportlet_backURL=/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=2022-500137-89-00&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2FfullInformation.xhtml&_emactdownload_WAR_emactpublicportlet_backURL=/view-clinical-trial?p_p_id=emactview_WAR_emactpublicportlet&p_p_lifecycle=0&p_p_state=normal&p_p_mode=view&p_p_col_id=column-1&p_p_col_count=1&_emactview_WAR_emactpublicportlet_number=2022-500137-89-00&_emactview_WAR_emactpublicportlet__facesViewIdRender=%2FWEB-INF%2Fviews%2Fview%2Ftabs%2FfullInformation.xhtml&_emactdownload_WAR_emactpublicportlet_downloadOptions={%22ctid%22:137,%22ctNumber%22:%222022-500137-89-00%22,%22includeSummary%22:1,%22includeFullTrial%22:1,%22includeEvents%22:0,%22includeResults%22:0,%22includeCorrectiveMeasures%22:0,%22includeInspectionRecords%22:0,%22includeDocuments%22:1,%22includedApplications%22:[]}'
-        response = requests.get(request_URL)
+        request_URL = self.full_zip_url()
+        response = self.__http().get(request_URL)
         assert response.status_code == 200
         return response.text
 
     
+    def download_full_zip(self, path: str, progress: Callable[[int, int], None] = None, sha256: str = None) -> str:
+        '''
+        Streams the full zip file to path and returns its SHA-256. Dropped transfers are resumed, see Download.download_file.
+        '''
+        return download_file(self.full_zip_url(), path, session=self.__http(), progress=progress, sha256=sha256)
+
+    
     def is_protocol_published(self) -> bool:
         '''
         Returns True if the trial has a full protocol published, False otherwise.
         '''
-        return any(doc.is_published_protocol() for doc in self.documents_part_1())
\ No newline at end of file
+        return any(doc.is_published_protocol() for doc in self.documents_part_1())
+
+    
+    @classmethod
+    def load_many(cls, EUCTNUMBERS: List[str], fields: List[str] = None, workers: int = 8, cache: PageCache = None) -> pd.core.frame.DataFrame:
+        '''
+        Loads many trials concurrently and returns a pandas dataframe with one row per trial, indexed by EUCT number.
+
+        fields are names from Trial.ACCESSORS (by default Trial.FIELDS). Since pages are loaded lazily, only the tabs these fields need are fetched. All requests share one connection pool.
+
+        A trial that fails does not stop the others: its row has the error message in the column "error" (which is empty otherwise) and empty values for the fields that could not be loaded.
+        '''
+        fields = cls.FIELDS if fields is None else fields
+        for field in fields:
+            if field not in cls.ACCESSORS:
+                raise ValueError("Unknown field: " + field)
+        session = CTIS.new_session(workers)
+
+        def load(EUCTNUMBER: str) -> Dict[str, object]:
+            row = dict.fromkeys(fields)
+            row['error'] = None
+            with cls(EUCTNUMBER, session=session, cache=cache) as trial:
+                try:
+                    for field in fields:
+                        row[field] = trial.__extract(field)
+                except Exception as e:
+                    row['error'] = type(e).__name__ + ": " + str(e)
+            return row
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(load, EUCTNUMBERS))
+        return pd.DataFrame(rows, index=pd.Index(EUCTNUMBERS, name='EUCTNUMBER'), columns=list(fields) + ['error'])
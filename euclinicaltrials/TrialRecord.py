@@ -0,0 +1,38 @@
+from __future__ import annotations
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Tuple
+from .Document import Document
+
+
+@dataclass(frozen=True)
+class TrialRecord:
+    '''
+    Everything about a trial that Trial can extract, as plain values. Unlike a Trial, it does not keep the parsed pages alive, so it is cheap to hold many of them.
+
+    Records are immutable and hashable, so the dictionaries Trial returns are stored as tuples of (key, value) pairs here. Use dict(record.planned_subjects_by_country) to look things up by country.
+    '''
+    __slots__ = ('EUCTNUMBER', 'scope', 'sponsor', 'conditions', 'population_type', 'description', 'therapeutic_area', 'phase', 'is_low_intervention', 'is_transition_trial', 'is_medical_device', 'first_submitted_date', 'last_update_date', 'total_planned_subjects', 'is_protocol_published', 'member_states_concerned', 'planned_subjects_by_country', 'documents_part_1', 'documents_part_2')
+    EUCTNUMBER: str
+    scope: str
+    sponsor: str
+    conditions: str
+    population_type: str
+    description: str
+    therapeutic_area: str
+    phase: str
+    is_low_intervention: bool
+    is_transition_trial: bool
+    is_medical_device: bool
+    first_submitted_date: date
+    last_update_date: date
+    total_planned_subjects: int
+    is_protocol_published: bool
+    member_states_concerned: Tuple[str, ...]
+    planned_subjects_by_country: Tuple[Tuple[str, int], ...]
+    documents_part_1: Tuple[Document, ...]
+    documents_part_2: Tuple[Tuple[str, Tuple[Document, ...]], ...]
+
+    def __reduce__(self):
+        # Frozen instances with __slots__ can't be restored by pickle's default way of setting attributes
+        return (TrialRecord, tuple(getattr(self, field.name) for field in fields(self)))
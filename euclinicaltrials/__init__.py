@@ -8,3 +8,12 @@ if sys.version_info < (3, 8):
 #from .lib import *
 from .Trial import *
 from .Document import *
+from .Cache import *
+from .TrialRecord import *
+from .Download import *
+from .Replay import *
+from .Async import *
+from .Transport import *
+from .Registry import *
+from .Index import *
+from .Instrumentation import Event, Profile
@@ -1,6 +1,847 @@
+import asyncio
+import dataclasses
 import datetime
-from euclinicaltrials import CTIS, Trial
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+import pytz
+import requests
+from euclinicaltrials import CTIS, Instrumentation, Transport, extract_record, Trial, Document, AsyncCTIS, CircuitBreaker, PortalSession, RateLimiter, Registry, TrialIndex, Profile, PageCache, BandwidthLimit, download_file, download_many, fetch_documents, recordings, replay_session, save_recording
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_fixtures')
+FIXTURE_TRIAL = '2022-500024-30-00'
+
+
+class StubPortal(BaseHTTPRequestHandler):
+    '''
+    A tiny stand-in for euclinicaltrials.eu. Tests set the class attributes to what the portal should serve.
+    '''
+    results_count = 45
+    view_state = 'stub-view-state'
+    jsessionid = 'stub-session'
+    etag = None
+    requests_seen = []
+    ranges_seen = []
+    encodings_seen = []
+    # Trial numbers that are served the pages of a fixture trial, and replacements made in all trial pages
+    aliases = {}
+    replacements = []
+    # The next this many requests to /flaky fail with a 503
+    flaky_failures = 0
+    # Served for downloads, under /files/ and as the zip of every trial
+    payload = bytes(range(256)) * 4096
+    # The next this many downloads break off halfway through
+    drops = 0
+    # Range requests are answered from this many bytes further on, like a misbehaving server would
+    range_shift = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body: bytes, headers: dict = {}, status: int = 200):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @classmethod
+    def trial_number(cls, row: int) -> str:
+        return '2022-5%05d-01-00' % row
+
+    @classmethod
+    def decision_date(cls, row: int) -> datetime.date:
+        # The search is sorted by decision date, newest first
+        return datetime.date(2022, 10, 1) - datetime.timedelta(days=row)
+
+    def do_GET(self):
+        type(self).requests_seen.append(('GET', self.path, None))
+        if self.path.startswith('/search-for-clinical-trials'):
+            body = '<html><body><span>%d results found</span><form><input id="_emactsearch_WAR_emactpublicportlet_:javax.faces.ViewState:0" value="%s"/></form></body></html>' % (self.results_count, self.view_state)
+            self.send_body(body.encode('utf-8'), {'Set-Cookie': 'JSESSIONID=%s; Path=/; HttpOnly' % self.jsessionid})
+        elif self.path.startswith('/flaky'):
+            if type(self).flaky_failures > 0:
+                type(self).flaky_failures -= 1
+                self.send_body(b'unavailable', {'Retry-After': '7'} if 'retry-after' in self.path else {}, status=503)
+            else:
+                self.send_body(b'ok')
+        elif self.path.startswith('/website-outages-and-system-releases'):
+            self.send_body(b'<html><body><p>CTIS public portal is temporarily unavailable</p></body></html>')
+        elif self.path.startswith('/files/') or self.path.startswith('/download-clinical-trial'):
+            self.send_payload()
+        elif self.path.startswith('/view-clinical-trial'):
+            query = parse_qs(urlparse(self.path).query)
+            number = query['_emactview_WAR_emactpublicportlet_number'][0]
+            tab = query['_emactview_WAR_emactpublicportlet__facesViewIdRender'][0].split('/')[-1].replace('.xhtml', '')
+            path = os.path.join(FIXTURES, self.aliases.get(number, number), tab + '.html')
+            if not os.path.isfile(path):
+                self.send_body(b'not found', status=404)
+            elif self.etag is not None and self.headers.get('If-None-Match') == self.etag:
+                self.send_body(b'', status=304)
+            else:
+                with open(path, 'rb') as f:
+                    page = f.read()
+                for old, new in self.replacements:
+                    page = page.replace(old, new)
+                self.send_body(page, {'ETag': self.etag} if self.etag is not None else {})
+        else:
+            self.send_body(b'not found', status=404)
+
+    def send_payload(self):
+        type(self).ranges_seen.append(self.headers.get('Range'))
+        type(self).encodings_seen.append(self.headers.get('Accept-Encoding'))
+        start = 0
+        if self.headers.get('Range') is not None:
+            start = int(re.match(r'bytes=(\d+)-', self.headers['Range']).group(1)) + self.range_shift
+            if start >= len(self.payload):
+                self.send_body(b'', {'Content-Range': 'bytes */%d' % len(self.payload)}, status=416)
+                return
+        body = self.payload[start:]
+        self.send_response(206 if start > 0 else 200)
+        if start > 0:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(self.payload) - 1, len(self.payload)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if type(self).drops > 0:
+            type(self).drops -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        type(self).requests_seen.append(('POST', self.path, body))
+        form = parse_qs(body)
+        assert form['javax.faces.ViewState'] == [self.view_state]
+        assert 'JSESSIONID=' + self.jsessionid in self.headers['Cookie']
+        page = int(form['_emactsearch_WAR_emactpublicportlet_:mainFormID:trialSearchResultsPaginatorId_paginatorAction'][0])
+        page_size = int(form['_emactsearch_WAR_emactpublicportlet_:mainFormID:searchResultRowsPerPageId'][0])
+        first = (page - 1) * page_size
+        rows = range(first, min(first + page_size, self.results_count))
+        # Every trial number shows up twice in a row, like in the link and the label of the real result table
+        content = ''.join('<tr><td><a>%s</a></td><td>%s</td><td>%s</td></tr>' % (self.trial_number(row), self.trial_number(row), self.decision_date(row).strftime('%d/%m/%Y')) for row in rows)
+        self.send_body(('<partial-response><![CDATA[<table>%s</table>]]></partial-response>' % content).encode('utf-8'))
+
+
+class StubPortalTestCase(unittest.TestCase):
+    '''
+    Runs a StubPortal on localhost and points CTIS.BASE_URI at it.
+    '''
+    handler = StubPortal
+
+    def setUp(self):
+        self.handler.requests_seen = []
+        self.handler.ranges_seen = []
+        self.handler.drops = 0
+        self.handler.flaky_failures = 0
+        self.handler.aliases = {}
+        self.handler.encodings_seen = []
+        self.handler.range_shift = 0
+        self.handler.replacements = []
+        self.handler.results_count = 45
+        # Tests shouldn't wait for the real maintenance windows or rate limit
+        for name, value in [('CIRCUIT_BREAKER', CircuitBreaker(pause_for_maintenance=False)), ('RATE_LIMITER', RateLimiter(rate=1000, burst=1000))]:
+            patcher = mock.patch.object(Transport, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_uri = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        patcher = mock.patch.object(CTIS, 'BASE_URI', self.base_uri)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+
+    def trial_requests(self) -> list:
+        return [r[1] for r in self.handler.requests_seen if r[1].startswith('/view-clinical-trial')]
+
+
+class SearchTest(StubPortalTestCase):
+    def test_get_all_trial_numbers(self):
+        trials = CTIS.get_all_trial_numbers()
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(45)])
+        self.assertEqual(len([r for r in self.handler.requests_seen if r[0] == 'POST']), 3)
+
+    def test_get_all_trial_numbers_concurrently(self):
+        trials = CTIS.get_all_trial_numbers(workers=4)
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(45)])
+
+    def posted_pages(self) -> list:
+        return [parse_qs(r[2])['_emactsearch_WAR_emactpublicportlet_:mainFormID:trialSearchResultsPaginatorId_paginatorAction'][0] for r in self.handler.requests_seen if r[0] == 'POST']
+
+    def test_page_size(self):
+        trials = CTIS.get_all_trial_numbers(page_size=100)
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(45)])
+        self.assertEqual(self.posted_pages(), ['1'])
+
+    def test_incremental_known(self):
+        known = {StubPortal.trial_number(row) for row in range(5, 45)}
+        trials = CTIS.get_all_trial_numbers(page_size=5, known=known)
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(5)])
+        self.assertEqual(self.posted_pages(), ['1', '2'])
+
+    def test_incremental_since(self):
+        since = StubPortal.decision_date(12)
+        trials = CTIS.get_all_trial_numbers(workers=2, page_size=5, since=since)
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(15)])
+        # While page 4 is read, the second worker may already fetch page 5
+        self.assertIn(sorted(self.posted_pages()), [['1', '2', '3', '4'], ['1', '2', '3', '4', '5']])
+
+    def test_iter_trial_numbers(self):
+        trials = CTIS.iter_trial_numbers(page_size=5)
+        self.assertEqual(next(trials), StubPortal.trial_number(0))
+        self.assertEqual(self.posted_pages(), ['1'])
+        trials.close()
+
+    def test_chunk_boundaries(self):
+        # With tiny chunks, numbers and dates are split between chunks all the time
+        with mock.patch.object(CTIS, 'CHUNK_SIZE', 7):
+            trials = CTIS.get_all_trial_numbers(page_size=5, since=StubPortal.decision_date(12))
+        self.assertEqual(trials, [StubPortal.trial_number(row) for row in range(15)])
+
+
+
+class TrialTest(StubPortalTestCase):
+    def test_one_trial(self):
+        test_trial = Trial(FIXTURE_TRIAL)
+        self.assertEqual(sorted(test_trial.scope().split(',')), ['Efficacy','Safety','Therapy'])
+        self.assertEqual(test_trial.conditions(), 'Post Kidney transplantation')
+        self.assertEqual(test_trial.population_type(), 'Women of child bearing potential using contraception, Patients')
+        self.assertTrue(test_trial.description().startswith('A non-inferiority, randomised and controlled trial'))
+        self.assertEqual(test_trial.therapeutic_area(), 'Diseases [C] - Nutritional and Metabolic Diseases [C18]')
+        self.assertEqual(test_trial.phase(), 'Therapeutic exploratory (Phase II)')
+        self.assertEqual(test_trial.sponsor(), 'Medical University Of Vienna')
+        self.assertEqual(len(test_trial.documents_part_1()), 4)
+        self.assertEqual(set(test_trial.member_states_concerned()), {'Austria', 'Czechia', 'France', 'Germany', 'Spain', 'Netherlands'})
+        self.assertEqual(test_trial.first_submitted_date(), datetime.date(2022, 3, 7))
+        self.assertEqual(test_trial.last_update_date(), datetime.date(2022, 8, 12))
+        self.assertFalse(test_trial.is_protocol_published())
+        self.assertFalse(test_trial.is_low_intervention())
+        self.assertFalse(test_trial.is_medical_device())
+        self.assertFalse(test_trial.is_transition_trial())
+        self.assertEqual(test_trial.planned_subjects_by_country()['Germany'], 50)
+        self.assertEqual(test_trial.total_planned_subjects(), 260)
+        self.assertEqual(len(test_trial.documents_part_2()['Spain']), 1)
+        # Each tab is only loaded once
+        self.assertEqual(len(self.trial_requests()), 2)
+
+
+    def test_to_record(self):
+        test_trial = Trial(FIXTURE_TRIAL)
+        record = test_trial.to_record()
+        self.assertEqual(record.EUCTNUMBER, FIXTURE_TRIAL)
+        self.assertEqual(record.sponsor, 'Medical University Of Vienna')
+        self.assertEqual(record.total_planned_subjects, 260)
+        self.assertEqual(dict(record.planned_subjects_by_country)['Austria'], 60)
+        self.assertEqual(len(record.documents_part_1), 4)
+        self.assertEqual(len(dict(record.documents_part_2)['Spain']), 1)
+        self.assertIn('Czechia', record.member_states_concerned)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            record.sponsor = 'Someone else'
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            record.documents_part_1[0].title = 'Something else'
+        self.assertEqual(hash(record), hash(dataclasses.replace(record)))
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        # The pages were released, so they are loaded again
+        self.assertEqual(len(self.trial_requests()), 2)
+        test_trial.phase()
+        self.assertEqual(len(self.trial_requests()), 3)
+
+    def test_context_manager(self):
+        with Trial(FIXTURE_TRIAL) as test_trial:
+            test_trial.sponsor()
+            test_trial.phase()
+        test_trial.phase()
+        self.assertEqual(len(self.trial_requests()), 2)
+
+    def test_status_table_matches_read_html(self):
+        with open(os.path.join(FIXTURES, FIXTURE_TRIAL, 'summary.html'), 'rb') as f:
+            table = CTIS.make_soup(f.read()).find(id='trialStatusInfoDataTableId')
+        expected = pd.read_html(io.StringIO(str(table)))[0]
+        expected.columns = expected.columns.droplevel(level=0)
+        pd.testing.assert_frame_equal(Trial(FIXTURE_TRIAL).overall_trial_status_table(), expected)
+
+    def test_parse_table_with_spans(self):
+        markup = '<table><thead><tr><th rowspan="2">Member state</th><th colspan="2">Dates</th><th rowspan="2">Subjects</th></tr><tr><th>Decision date</th><th>Start date</th></tr></thead><tbody><tr><td rowspan="2">Austria</td><td>10/05/2022</td><td>11/06/2022</td><td>1,234</td></tr><tr><td colspan="2">12/07/2022</td><td>56</td></tr></tbody></table>'
+        expected = pd.read_html(io.StringIO(markup))[0]
+        expected.columns = expected.columns.droplevel(level=0)
+        df = CTIS.parse_table(CTIS.make_soup(markup).table)
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(df['Subjects'].tolist(), [1234, 56])
+
+    def test_parse_table_rejects_rows_that_dont_fit(self):
+        markup = '<table><thead><tr><th>Member state</th><th>Status</th></tr></thead><tbody><tr><td colspan="2">No records found</td></tr><tr><td>Austria</td></tr></tbody></table>'
+        with self.assertRaises(ValueError):
+            CTIS.parse_table(CTIS.make_soup(markup).table)
+
+    def test_derived_structures_are_memoised(self):
+        test_trial = Trial(FIXTURE_TRIAL)
+        with mock.patch.object(CTIS, 'parse_table', wraps=CTIS.parse_table) as parse_table, mock.patch.object(CTIS, 'separate_accordion_sections', wraps=CTIS.separate_accordion_sections) as separate:
+            test_trial.member_states_concerned()
+            test_trial.overall_trial_status_table().drop(columns='Member state', inplace=True)
+            self.assertEqual(len(test_trial.member_states_concerned()), 6)
+            test_trial.planned_subjects_by_country()
+            test_trial.total_planned_subjects()
+            test_trial.documents_part_2()
+            self.assertEqual(parse_table.call_count, 1)
+            self.assertEqual(separate.call_count, 1)
+            test_trial.refresh()
+            test_trial.member_states_concerned()
+            self.assertEqual(parse_table.call_count, 2)
+        self.assertEqual(len(self.trial_requests()), 3)
+
+    def test_load_many(self):
+        df = Trial.load_many([FIXTURE_TRIAL, '2022-500000-00-00'], fields=['sponsor', 'last_update_date'], workers=2)
+        self.assertEqual(list(df.columns), ['sponsor', 'last_update_date', 'error'])
+        self.assertEqual(df.loc[FIXTURE_TRIAL, 'sponsor'], 'Medical University Of Vienna')
+        self.assertEqual(df.loc[FIXTURE_TRIAL, 'last_update_date'], datetime.date(2022, 8, 12))
+        self.assertTrue(pd.isna(df.loc[FIXTURE_TRIAL, 'error']))
+        # The portal doesn't know the second trial, but that doesn't stop the batch
+        self.assertIsNotNone(df.loc['2022-500000-00-00', 'error'])
+        # Only the summary tab is needed for these fields
+        self.assertEqual(len(self.trial_requests()), 2)
+
+    def test_load_many_unknown_field(self):
+        with self.assertRaises(ValueError):
+            Trial.load_many([FIXTURE_TRIAL], fields=['nonsense'])
+        with self.assertRaises(ValueError):
+            Trial.load_many([FIXTURE_TRIAL], fields=['refresh'])
+
+
+class TrialLxmlTest(TrialTest):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(CTIS, 'PARSER', 'lxml')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TrialFormsOnlyTest(TrialTest):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(CTIS, 'PARSE_ONLY', CTIS.FORMS_ONLY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class PageCacheTest(StubPortalTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'pages.sqlite')
+
+    def test_cache_across_instances(self):
+        cache = PageCache(self.path)
+        self.assertEqual(Trial(FIXTURE_TRIAL, cache=cache).sponsor(), 'Medical University Of Vienna')
+        cache.close()
+        cache = PageCache(self.path)
+        self.assertEqual(Trial(FIXTURE_TRIAL, cache=cache).sponsor(), 'Medical University Of Vienna')
+        self.assertEqual(len(self.trial_requests()), 1)
+        cache.close()
+
+    def test_error_pages_are_not_cached(self):
+        cache = PageCache(self.path)
+        self.addCleanup(cache.close)
+        number = '2022-500000-00-00'
+        with self.assertRaises(requests.HTTPError):
+            Trial(number, cache=cache).sponsor()
+        self.assertIsNone(cache.get(number, 'summary'))
+        self.handler.aliases = {number: FIXTURE_TRIAL}
+        self.assertEqual(Trial(number, cache=cache).sponsor(), 'Medical University Of Vienna')
+
+    def test_revalidation_with_etag(self):
+        self.handler.etag = '"v1"'
+        self.addCleanup(setattr, self.handler, 'etag', None)
+        cache = PageCache(self.path, ttl=0)
+        Trial(FIXTURE_TRIAL, cache=cache).sponsor()
+        self.assertEqual(Trial(FIXTURE_TRIAL, cache=cache).sponsor(), 'Medical University Of Vienna')
+        self.assertEqual(len(self.trial_requests()), 2)
+        self.assertEqual(self.handler.requests_seen[-1][0], 'GET')
+        cache.close()
+
+    def test_revalidation_with_last_update_date(self):
+        cache = PageCache(self.path, ttl=0)
+        Trial(FIXTURE_TRIAL, cache=cache).scope()
+        Trial(FIXTURE_TRIAL, cache=cache).sponsor()
+        # The summary is unchanged, so the full information tab is reused
+        self.assertEqual(Trial(FIXTURE_TRIAL, cache=cache).scope(), 'Therapy,Safety,Efficacy')
+        self.assertEqual([urlparse(r).query.split('%2F')[-1] for r in self.trial_requests()], ['fullInformation.xhtml', 'summary.xhtml', 'summary.xhtml'])
+        # Once the last update date moves, the other tabs are dropped
+        with open(os.path.join(FIXTURES, FIXTURE_TRIAL, 'summary.html'), 'rb') as f:
+            cache.put(FIXTURE_TRIAL, 'summary', f.read().replace(b'12/08/2022', b'01/08/2022'))
+        Trial(FIXTURE_TRIAL, cache=cache).sponsor()
+        self.assertIsNone(cache.get(FIXTURE_TRIAL, 'fullInformation'))
+        cache.close()
+
+    def test_eviction(self):
+        cache = PageCache(self.path, max_size=100)
+        cache.put('a', 'summary', b'x' * 60)
+        cache.put('b', 'summary', b'x' * 60)
+        self.assertIsNone(cache.get('a', 'summary'))
+        self.assertEqual(cache.get('b', 'summary').content, b'x' * 60)
+        self.assertEqual(cache.size(), 60)
+        cache.close()
+
+
+class DownloadTest(StubPortalTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.sha256 = hashlib.sha256(StubPortal.payload).hexdigest()
+
+    def test_download_file(self):
+        path = os.path.join(self.directory, 'file.bin')
+        progress = []
+        digest = download_file(self.base_uri + '/files/file.bin', path, progress=lambda done, total: progress.append((done, total)), sha256=self.sha256)
+        self.assertEqual(digest, self.sha256)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), StubPortal.payload)
+        self.assertEqual(progress[-1], (len(StubPortal.payload), len(StubPortal.payload)))
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_resume(self):
+        self.handler.drops = 2
+        path = os.path.join(self.directory, 'file.bin')
+        self.assertEqual(download_file(self.base_uri + '/files/file.bin', path, sha256=self.sha256), self.sha256)
+        half = len(StubPortal.payload) // 2
+        self.assertEqual(self.handler.ranges_seen, [None, 'bytes=%d-' % half, 'bytes=%d-' % (half + half // 2)])
+        self.assertEqual(self.handler.encodings_seen, ['identity'] * 3)
+
+    def test_resume_with_wrong_range(self):
+        self.handler.drops = 1
+        self.handler.range_shift = 10
+        path = os.path.join(self.directory, 'file.bin')
+        self.assertEqual(download_file(self.base_uri + '/files/file.bin', path, sha256=self.sha256), self.sha256)
+        self.assertEqual(self.handler.ranges_seen, [None, 'bytes=%d-' % (len(StubPortal.payload) // 2), None])
+
+    def test_resume_across_calls(self):
+        self.handler.drops = 1
+        path = os.path.join(self.directory, 'file.bin')
+        with self.assertRaises(requests.exceptions.RequestException):
+            download_file(self.base_uri + '/files/file.bin', path, retries=0)
+        self.assertTrue(os.path.exists(path + '.part'))
+        self.assertEqual(download_file(self.base_uri + '/files/file.bin', path), self.sha256)
+
+    def test_part_file_that_doesnt_fit(self):
+        path = os.path.join(self.directory, 'file.bin')
+        with open(path + '.part', 'wb') as f:
+            f.write(StubPortal.payload + b'left over')
+        self.assertEqual(download_file(self.base_uri + '/files/file.bin', path, sha256=self.sha256), self.sha256)
+        self.assertEqual(self.handler.ranges_seen, ['bytes=%d-' % (len(StubPortal.payload) + 9), None])
+
+    def test_checksum_mismatch(self):
+        path = os.path.join(self.directory, 'file.bin')
+        with self.assertRaises(ValueError):
+            download_file(self.base_uri + '/files/file.bin', path, sha256='0' * 64)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_download_full_zip(self):
+        path = os.path.join(self.directory, FIXTURE_TRIAL + '.zip')
+        self.assertEqual(Trial(FIXTURE_TRIAL).download_full_zip(path), self.sha256)
+        zip_path = [path for method, path, body in self.handler.requests_seen if path.startswith('/download-clinical-trial')][0]
+        self.assertIn(FIXTURE_TRIAL, zip_path)
+        self.assertNotIn('2022-500137-89-00', zip_path)
+
+    def test_download_many(self):
+        self.handler.drops = 1
+        downloads = [(self.base_uri + '/files/%d.bin' % i, os.path.join(self.directory, '%d.bin' % i)) for i in range(4)]
+        downloads.append((self.base_uri + '/missing', os.path.join(self.directory, 'missing.bin')))
+        results = download_many(downloads, workers=2, max_bytes_per_second=1e9)
+        for url, path in downloads[:4]:
+            self.assertEqual(results[path], self.sha256)
+        self.assertIsInstance(results[downloads[4][1]], requests.exceptions.HTTPError)
+
+    def test_fetch_documents(self):
+        documents = [
+            Document(url='/files/protocol.pdf', title='Protocol', filetype='PDF', documenttype='Protocol (for publication)'),
+            Document(url=self.base_uri + '/files/same-protocol.pdf', title='Protocol', filetype='PDF', documenttype='Protocol (for publication)'),
+            Document(url=None, title='Protocol', filetype='', documenttype='Protocol (for publication)'),
+            Document(url='/missing.pdf', title='Missing', filetype='PDF', documenttype='Cover letter (for publication)'),
+        ]
+        results = fetch_documents(documents, self.directory, workers=2)
+        stored = os.path.join(self.directory, self.sha256[:2], self.sha256)
+        self.assertEqual(results[self.base_uri + '/files/protocol.pdf'], stored)
+        self.assertEqual(results[self.base_uri + '/files/same-protocol.pdf'], stored)
+        self.assertIsInstance(results[self.base_uri + '/missing.pdf'], Exception)
+        self.assertEqual(len(results), 3)
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest[self.base_uri + '/files/protocol.pdf']['sha256'], self.sha256)
+        self.assertEqual(manifest[self.base_uri + '/files/protocol.pdf']['documenttype'], 'Protocol (for publication)')
+        # Only the missing document is tried again
+        self.handler.ranges_seen = []
+        fetch_documents(documents, self.directory)
+        self.assertEqual(len(self.handler.ranges_seen), 0)
+        self.assertEqual(self.handler.requests_seen[-1][1], '/missing.pdf')
+
+    def test_bandwidth_limit(self):
+        now = [0.0]
+        slept = []
+        limit = BandwidthLimit(100, clock=lambda: now[0], sleep=slept.append)
+        limit.consume(50)
+        limit.consume(100)
+        self.assertEqual(slept, [0.5, 1.5])
+
+
+class ReplayTest(StubPortalTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_record_and_replay(self):
+        session = replay_session(self.directory, mode='record')
+        # Recording goes to the portal, so it is rate limited and retried
+        self.assertIsInstance(session, PortalSession)
+        trials = CTIS.get_all_trial_numbers(session=session, page_size=20)
+        recorded = Trial(FIXTURE_TRIAL, session=session).to_record()
+        request_count = len(self.handler.requests_seen)
+        session = replay_session(self.directory)
+        self.assertEqual(CTIS.get_all_trial_numbers(session=session, page_size=20), trials)
+        self.assertEqual(Trial(FIXTURE_TRIAL, session=session).to_record(), recorded)
+        self.assertEqual(len(self.handler.requests_seen), request_count)
+        self.assertIn(('POST', CTIS.BASE_URI + '/search-for-clinical-trials?p_p_id=emactsearch_WAR_emactpublicportlet&p_p_lifecycle=2&p_p_state=normal&p_p_mode=view&p_p_cacheability=cacheLevelPage&p_p_col_id=column-1&p_p_col_count=1&_emactsearch_WAR_emactpublicportlet__jsfBridgeAjax=true&_emactsearch_WAR_emactpublicportlet__facesViewIdResource=%2FWEB-INF%2Fviews%2Fsearch%2Ftabs%2FsearchResults.xhtml'), list(recordings(self.directory)))
+
+    def test_missing_recording(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            Trial(FIXTURE_TRIAL, session=replay_session(self.directory)).sponsor()
+        self.assertEqual(len(self.handler.requests_seen), 0)
+
+    def test_save_recording(self):
+        save_recording(self.directory, 'GET', Trial(FIXTURE_TRIAL).tab_url('summary'), b'<html><body><span id="_emactview_WAR_emactpublicportlet_:mainFormID:trialInfoSponsorId">Someone</span></body></html>')
+        self.assertEqual(Trial(FIXTURE_TRIAL, session=replay_session(self.directory)).sponsor(), 'Someone')
+
+
+class AsyncTest(StubPortalTestCase):
+    def test_trial_numbers(self):
+        async def collect():
+            async with AsyncCTIS(concurrency=3) as client:
+                return [number async for number in client.trial_numbers(page_size=10)]
+        self.assertEqual(asyncio.run(collect()), [StubPortal.trial_number(row) for row in range(45)])
+
+    def test_records(self):
+        async def load():
+            async with AsyncCTIS(concurrency=4) as client:
+                records = await client.records([FIXTURE_TRIAL, FIXTURE_TRIAL])
+                async_trial = client.trial(FIXTURE_TRIAL)
+                await async_trial.load(['summary'])
+                return records, async_trial.trial().sponsor()
+        with mock.patch.object(CTIS, 'default_session', side_effect=AssertionError("The client's session should be used")):
+            records, sponsor = asyncio.run(load())
+        self.assertEqual(records, [Trial(FIXTURE_TRIAL).to_record()] * 2)
+        self.assertEqual(sponsor, 'Medical University Of Vienna')
+
+    def test_error_pages_raise(self):
+        async def load():
+            async with AsyncCTIS(concurrency=2, parse_executor=ThreadPoolExecutor()) as client:
+                await client.trial('2022-500000-00-00').record()
+        with self.assertRaises(requests.HTTPError):
+            asyncio.run(load())
+
+    def test_sweep_shares_concurrency(self):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        async def run():
+            async with AsyncCTIS(concurrency=2, parse_executor=ThreadPoolExecutor()) as client:
+                request = client.session.request
+
+                def counted(*args, **kwargs):
+                    with lock:
+                        in_flight[0] += 1
+                        in_flight[1] = max(in_flight)
+                    try:
+                        time.sleep(0.01)
+                        return request(*args, **kwargs)
+                    finally:
+                        with lock:
+                            in_flight[0] -= 1
+                client.session.request = counted
+
+                async def sweep():
+                    return [number async for number in client.trial_numbers(page_size=5)]
+                return await asyncio.gather(sweep(), client.records([FIXTURE_TRIAL] * 4))
+        numbers, records = asyncio.run(run())
+        self.assertEqual(len(numbers), 45)
+        self.assertEqual(len(records), 4)
+        self.assertLessEqual(in_flight[1], 2)
+
+    def test_parser_settings_reach_the_process_pool(self):
+        pages = {}
+        for tab in ['summary', 'fullInformation']:
+            with open(os.path.join(FIXTURES, FIXTURE_TRIAL, tab + '.html'), 'rb') as f:
+                pages[tab] = f.read()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            record = executor.submit(extract_record, FIXTURE_TRIAL, pages, 'lxml', CTIS.FORMS_ONLY).result()
+            parser = executor.submit(eval, "__import__('euclinicaltrials').CTIS.PARSER").result()
+        # The settings are used for this record only, not written into the worker's module
+        self.assertEqual(parser, CTIS.PARSER)
+        self.assertEqual(record, Trial(FIXTURE_TRIAL).to_record())
+        with mock.patch.object(CTIS, 'make_soup', wraps=CTIS.make_soup) as make_soup:
+            extract_record(FIXTURE_TRIAL, pages, 'lxml', CTIS.FORMS_ONLY)
+        self.assertEqual({call.args[1:] for call in make_soup.call_args_list}, {(CTIS.FORMS_ONLY, 'lxml')})
+
+    def test_from_pages(self):
+        with open(os.path.join(FIXTURES, FIXTURE_TRIAL, 'summary.html'), 'rb') as f:
+            test_trial = Trial.from_pages(FIXTURE_TRIAL, {'summary': f.read()})
+        self.assertEqual(test_trial.sponsor(), 'Medical University Of Vienna')
+        self.assertEqual(len(self.trial_requests()), 0)
+        self.assertEqual(test_trial.scope(), 'Therapy,Safety,Efficacy')
+        self.assertEqual(len(self.trial_requests()), 1)
+
+
+class FakeClock:
+    def __init__(self, now: float = 0) -> None:
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TransportTest(StubPortalTestCase):
+    def test_rate_limiter(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, clock=clock.time, sleep=clock.sleep)
+        for i in range(4):
+            limiter.acquire()
+        self.assertEqual(clock.sleeps, [0.5, 0.5])
+        clock.now += 10
+        limiter.acquire()
+        self.assertEqual(clock.sleeps, [0.5, 0.5])
+
+    def test_circuit_breaker_opens_after_failures(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, pause_for_maintenance=False, clock=clock.time, sleep=clock.sleep)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertFalse(breaker.is_open())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        breaker.wait()
+        self.assertEqual(clock.now, 30)
+        self.assertFalse(breaker.is_open())
+
+    def test_circuit_breaker_waits_for_maintenance(self):
+        amsterdam = pytz.timezone('Europe/Amsterdam')
+        # A Tuesday evening, during the maintenance window
+        clock = FakeClock(amsterdam.localize(datetime.datetime(2022, 10, 18, 19, 30)).timestamp())
+        breaker = CircuitBreaker(maintenance_poll=60, clock=clock.time, sleep=clock.sleep)
+        self.assertTrue(breaker.is_open())
+        breaker.wait()
+        resumed = datetime.datetime.fromtimestamp(clock.now, amsterdam)
+        self.assertEqual((resumed.hour, resumed.minute), (21, 0))
+
+    def test_maintenance_window(self):
+        amsterdam = pytz.timezone('Europe/Amsterdam')
+        self.assertTrue(CTIS.is_maintenace_window(amsterdam.localize(datetime.datetime(2022, 10, 1, 11, 0))))
+        self.assertFalse(CTIS.is_maintenace_window(amsterdam.localize(datetime.datetime(2022, 10, 2, 11, 0))))
+        self.assertFalse(CTIS.is_maintenace_window(amsterdam.localize(datetime.datetime(2022, 10, 8, 11, 0))))
+        self.assertTrue(CTIS.is_maintenace_window(amsterdam.localize(datetime.datetime(2022, 10, 20, 18, 0))))
+        self.assertFalse(CTIS.is_maintenace_window(amsterdam.localize(datetime.datetime(2022, 10, 20, 21, 0))))
+
+    def test_is_unavailable_during_maintenance(self):
+        amsterdam = pytz.timezone('Europe/Amsterdam')
+        # A Tuesday evening, during the maintenance window
+        clock = FakeClock(amsterdam.localize(datetime.datetime(2022, 10, 18, 19, 30)).timestamp())
+        breaker = CircuitBreaker(clock=clock.time, sleep=clock.sleep)
+        self.assertTrue(breaker.is_open())
+        with mock.patch.object(Transport, 'CIRCUIT_BREAKER', breaker):
+            self.assertTrue(CTIS.is_unavailable())
+        self.assertEqual(clock.sleeps, [])
+
+    def session(self, clock: FakeClock, retries: int = 4) -> PortalSession:
+        return PortalSession(retries=retries, circuit_breaker=CircuitBreaker(pause_for_maintenance=False), sleep=clock.sleep, jitter=lambda low, high: high)
+
+    def test_retry(self):
+        self.handler.flaky_failures = 3
+        clock = FakeClock()
+        response = self.session(clock).get(self.base_uri + '/flaky')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(clock.sleeps, [1, 2, 4])
+
+    def test_retry_after(self):
+        self.handler.flaky_failures = 1
+        clock = FakeClock()
+        self.assertEqual(self.session(clock).get(self.base_uri + '/flaky-retry-after').status_code, 200)
+        self.assertEqual(clock.sleeps, [7])
+
+    def test_retries_run_out(self):
+        self.handler.flaky_failures = 5
+        clock = FakeClock()
+        self.assertEqual(self.session(clock, retries=2).get(self.base_uri + '/flaky').status_code, 503)
+        self.assertEqual(self.handler.flaky_failures, 2)
+
+    def test_connection_errors_are_retried(self):
+        clock = FakeClock()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.session(clock, retries=2).get('http://127.0.0.1:1/')
+        self.assertEqual(clock.sleeps, [1, 2])
+
+    def test_trials_use_the_transport(self):
+        self.assertIsInstance(CTIS.default_session(), PortalSession)
+        self.assertIsInstance(CTIS.new_session(), PortalSession)
+
+
+class RegistryTest(StubPortalTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = Registry(os.path.join(directory.name, 'registry.sqlite'))
+        self.addCleanup(self.registry.close)
+        self.handler.results_count = 4
+        self.numbers = [StubPortal.trial_number(row) for row in range(4)]
+        # The last trial has no pages, so loading it fails
+        self.handler.aliases = {number: FIXTURE_TRIAL for number in self.numbers[:3]}
+
+    def full_information_requests(self) -> int:
+        return len([r for r in self.trial_requests() if 'fullInformation' in r and self.numbers[3] not in r])
+
+    def test_sync(self):
+        result = self.registry.sync(workers=2)
+        self.assertEqual({outcome: numbers for outcome, numbers in result.items() if outcome != 'failed'}, {'new': self.numbers[:3], 'updated': [], 'unchanged': [], 'removed': []})
+        self.assertEqual(list(result['failed']), self.numbers[3:])
+        self.assertIn('404', result['failed'][self.numbers[3]])
+        self.assertEqual(self.full_information_requests(), 3)
+        record = self.registry.get(self.numbers[0])
+        self.assertEqual(record, dataclasses.replace(Trial(FIXTURE_TRIAL).to_record(), EUCTNUMBER=self.numbers[0]))
+        self.assertIsNone(self.registry.get(self.numbers[3]))
+
+        # Nothing changed, so only the summaries are loaded
+        result = self.registry.sync(workers=2)
+        self.assertEqual(result['unchanged'], self.numbers[:3])
+        self.assertEqual(self.full_information_requests(), 4)
+
+        # Now the trials were updated
+        self.handler.replacements = [(b'12/08/2022', b'01/09/2022'), (b'Medical University Of Vienna', b'Someone else')]
+        result = self.registry.sync(workers=2)
+        self.assertEqual(result['updated'], self.numbers[:3])
+        self.assertEqual(self.registry.get(self.numbers[1]).sponsor, 'Someone else')
+        self.assertEqual(self.registry.last_update_dates()[self.numbers[1]], datetime.date(2022, 9, 1))
+
+        # The portal doesn't list the last two trials anymore
+        self.handler.results_count = 2
+        result = self.registry.sync(workers=2)
+        self.assertEqual(result['removed'], self.numbers[2:3])
+        self.assertEqual(self.registry.numbers(), set(self.numbers[:2]))
+
+    def test_frame(self):
+        self.registry.sync()
+        df = self.registry.frame()
+        self.assertEqual(list(df.index), self.numbers[:3])
+        self.assertEqual(df.loc[self.numbers[0], 'first_submitted_date'], datetime.date(2022, 3, 7))
+        self.assertEqual(df.loc[self.numbers[0], 'is_low_intervention'], False)
+        self.assertEqual(df.loc[self.numbers[0], 'total_planned_subjects'], 260)
+        self.assertEqual(self.registry.records(), [self.registry.get(number) for number in self.numbers[:3]])
+        index = TrialIndex.from_registry(self.registry)
+        self.assertEqual(index.query(member_state='Austria', phase='Therapeutic exploratory (Phase II)'), self.numbers[:3])
+
+
+class TrialIndexTest(StubPortalTestCase):
+    def setUp(self):
+        super().setUp()
+        record = Trial(FIXTURE_TRIAL).to_record()
+        self.records = [
+            record,
+            dataclasses.replace(record, EUCTNUMBER='2023-500001-01-00', phase='Therapeutic confirmatory (Phase III)', member_states_concerned=('France',), first_submitted_date=datetime.date(2023, 1, 5)),
+            dataclasses.replace(record, EUCTNUMBER='2023-500002-01-00', sponsor='Someone else', is_low_intervention=True, first_submitted_date=datetime.date(2023, 6, 1)),
+        ]
+        self.index = TrialIndex(self.records)
+
+    def test_query(self):
+        self.assertEqual(self.index.query(), ['2022-500024-30-00', '2023-500001-01-00', '2023-500002-01-00'])
+        self.assertEqual(self.index.query(member_state='Austria'), ['2022-500024-30-00', '2023-500002-01-00'])
+        self.assertEqual(self.index.query(member_state=['Austria', 'France'], phase='Therapeutic confirmatory (Phase III)'), ['2023-500001-01-00'])
+        self.assertEqual(self.index.query(is_low_intervention=True), ['2023-500002-01-00'])
+        self.assertEqual(self.index.query(sponsor='Nobody'), [])
+        self.assertEqual(self.index.values('sponsor'), {self.records[0].sponsor: 2, 'Someone else': 1})
+        with self.assertRaises(ValueError):
+            self.index.query(colour='red')
+
+    def test_date_ranges(self):
+        self.assertEqual(self.index.query(first_submitted_date=(datetime.date(2023, 1, 5), datetime.date(2023, 6, 1))), ['2023-500001-01-00', '2023-500002-01-00'])
+        self.assertEqual(self.index.query(first_submitted_date=(None, datetime.date(2023, 1, 4))), ['2022-500024-30-00'])
+        self.assertEqual(self.index.query(first_submitted_date=(datetime.date(2023, 2, 1), None), member_state='Austria'), ['2023-500002-01-00'])
+
+    def test_frame(self):
+        df = self.index.frame(phase='Therapeutic confirmatory (Phase III)')
+        self.assertEqual(list(df.index), ['2023-500001-01-00'])
+        self.assertEqual(df.loc['2023-500001-01-00', 'first_submitted_date'], datetime.date(2023, 1, 5))
+        self.assertEqual(self.index.records(is_low_intervention=True), self.records[2:])
+
+
+class InstrumentationTest(StubPortalTestCase):
+    def test_profile(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = PageCache(os.path.join(directory.name, 'pages.sqlite'))
+        self.addCleanup(cache.close)
+        with Profile() as profile:
+            Trial(FIXTURE_TRIAL, cache=cache).to_record()
+            Trial(FIXTURE_TRIAL, cache=cache).to_record()
+        summary = profile.summary()
+        self.assertEqual(summary.loc[('request', 'GET'), 'count'], len(self.trial_requests()))
+        self.assertEqual(summary.loc[('cache', 'miss'), 'count'], len(self.trial_requests()))
+        self.assertEqual(summary.loc[('cache', 'hit'), 'count'], len(self.trial_requests()))
+        self.assertGreater(summary.loc[('request', 'GET'), 'bytes'], 0)
+        self.assertEqual(summary.loc[('extract', 'sponsor'), 'count'], 2)
+        self.assertGreater(summary.loc[('parse', 'soup'), 'total_seconds'], 0)
+        self.assertEqual(profile.cache_hit_rate(), 0.5)
+        output = io.StringIO()
+        profile.dump(output)
+        self.assertIn('sponsor', output.getvalue())
+        self.assertIn('Cache hit rate: 50.0%', output.getvalue())
+
+        # The profile stopped listening at the end of the with block
+        Trial(FIXTURE_TRIAL).sponsor()
+        self.assertEqual(profile.summary().loc[('extract', 'sponsor'), 'count'], 2)
+
+    def test_retries(self):
+        self.handler.flaky_failures = 2
+        events = []
+        session = PortalSession(circuit_breaker=CircuitBreaker(pause_for_maintenance=False), sleep=lambda seconds: None)
+        with Instrumentation.listening(events.append):
+            session.get(self.base_uri + '/flaky')
+        self.assertEqual([(event.kind, event.name, event.retries, event.status) for event in events], [('request', 'GET', 2, 200)])
+
+    def test_search(self):
+        with Profile() as profile:
+            numbers = CTIS.get_all_trial_numbers()
+        summary = profile.summary()
+        self.assertEqual(summary.loc[('parse', 'search page'), 'count'], 3)
+        self.assertGreater(summary.loc[('parse', 'search page'), 'bytes'], 0)
+        self.assertEqual(len(numbers), 45)
 
 
 class OnlineTest(unittest.TestCase):